@@ -0,0 +1,207 @@
+from datetime import datetime, timezone
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy import case, func, insert, select
+
+from models import db, QuizAnswer
+
+logger = logging.getLogger(__name__)
+
+"""
+AnswerBuffer
+    write-behind buffer for quiz answers.
+
+    add() only appends the answer to an in-memory list and updates the
+    precomputed leaderboard; the list is written to quiz_answers with one
+    multi-row INSERT once it holds flush_size answers, or every
+    flush_interval seconds from a background thread, whichever comes first.
+    A failed flush puts its rows back; at most max_pending answers are held
+    (pending or being written), and full() tells callers to stop adding.
+
+    The leaderboard and totals are loaded from a GROUP BY over quiz_answers
+    the first time they are read, then kept up to date incrementally as this
+    worker ingests answers, and re-read every refresh_interval seconds to
+    pick up answers ingested by other workers.
+"""
+class AnswerBuffer:
+    def __init__(
+        self, app, flush_size=100, flush_interval=1.0, refresh_interval=30.0,
+        max_pending=10000,
+    ):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = []
+        self._in_flight = 0
+        self._players = None
+        self._categories = None
+        self._loaded_at = 0.0
+        self._thread = None
+
+    def add(self, player, question_id, correct, category=None):
+        row = {
+            'player': player,
+            'question_id': question_id,
+            'category': category,
+            'correct': correct,
+            'answered_at': datetime.now(timezone.utc).replace(tzinfo=None),
+        }
+        with self._lock:
+            self._pending.append(row)
+            if self._players is not None:
+                self._count(row)
+            full = len(self._pending) >= self.flush_size
+        self._start()
+        if full:
+            # the answer is buffered either way; a failed flush is retried
+            # by the background thread
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('flushing quiz answers failed')
+
+    def full(self):
+        with self._lock:
+            return len(self._pending) + self._in_flight >= self.max_pending
+
+    def _count(self, row):
+        player = self._players.setdefault(row['player'], [0, 0])
+        player[0] += 1
+        player[1] += int(row['correct'])
+        category = self._categories.setdefault(row['category'], [0, 0])
+        category[0] += 1
+        category[1] += int(row['correct'])
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name='answer-buffer', daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('flushing quiz answers failed')
+
+    def flush(self):
+        """Write every pending answer with a single multi-row INSERT"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._pending = self._pending, []
+                self._in_flight = len(rows)
+            if not rows:
+                return 0
+            try:
+                with self.app.app_context():
+                    db.session.execute(insert(QuizAnswer), rows)
+                    db.session.commit()
+            except Exception:
+                with self._lock:
+                    self._pending = rows + self._pending
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight = 0
+            return len(rows)
+
+    def after_fork(self):
+        """Reset thread state inherited from the parent process"""
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._in_flight = 0
+        # the parent still owns its pending answers and will flush them
+        self._pending = []
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def reconcile(self):
+        """Flush pending answers and recompute the aggregates from the database"""
+        self.flush()
+        self._load(force=True)
+        return self.stats()
+
+    def _load(self, force=False):
+        if (
+            not force
+            and self._players is not None
+            and time.monotonic() - self._loaded_at < self.refresh_interval
+        ):
+            return
+        # hold the flush lock so no batch is in flight between the
+        # database read and the pending rows being counted on top of it
+        with self._flush_lock:
+            correct = func.sum(case((QuizAnswer.correct, 1), else_=0))
+            player_rows = db.session.execute(
+                select(QuizAnswer.player, func.count(QuizAnswer.id), correct)
+                .group_by(QuizAnswer.player)
+            ).all()
+            category_rows = db.session.execute(
+                select(QuizAnswer.category, func.count(QuizAnswer.id), correct)
+                .group_by(QuizAnswer.category)
+            ).all()
+            with self._lock:
+                self._players = {
+                    player: [answered, int(correct or 0)]
+                    for player, answered, correct in player_rows
+                }
+                self._categories = {
+                    category: [answered, int(correct or 0)]
+                    for category, answered, correct in category_rows
+                }
+                for row in self._pending:
+                    self._count(row)
+                self._loaded_at = time.monotonic()
+
+    def leaderboard(self, limit=10):
+        self._load()
+        with self._lock:
+            players = sorted(
+                self._players.items(),
+                key=lambda item: (-item[1][1], item[1][0], item[0]),
+            )
+            return [
+                {
+                    'player': player,
+                    'answered': answered,
+                    'correct': correct,
+                    'accuracy': round(correct / answered, 4) if answered else 0.0,
+                }
+                for player, (answered, correct) in players[:limit]
+            ]
+
+    def stats(self):
+        self._load()
+        with self._lock:
+            answered = sum(answered for answered, correct in self._categories.values())
+            correct = sum(correct for answered, correct in self._categories.values())
+            return {
+                'total_answers': answered,
+                'total_correct': correct,
+                'players': len(self._players),
+                'categories': [
+                    {'id': category, 'answered': answered, 'correct': correct}
+                    for category, (answered, correct) in sorted(
+                        self._categories.items(),
+                        key=lambda item: (item[0] is None, item[0] or 0),
+                    )
+                ],
+            }
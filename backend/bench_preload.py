@@ -0,0 +1,110 @@
+"""
+Startup and memory benchmark: workers forked from a preloaded master
+(wsgi.py: create_app, warm_app, gc.freeze, then post_fork in each worker)
+versus workers that each build their own app after the fork.
+
+For each worker it reports the time until it could serve its first request
+and its unique set size (private memory, from /proc/self/smaps_rollup, so
+Linux only) after serving a few requests. Run from the backend directory
+against the configured database, or pass a SQLAlchemy URI:
+
+    python bench_preload.py [--workers 4] [--database-uri sqlite:////tmp/trivia.db]
+"""
+import argparse
+import gc
+import json
+import os
+import time
+
+from flaskr import create_app, warm_app, post_fork
+
+REQUESTS = (
+    '/categories',
+    '/questions?page=1',
+    '/questions?page=2',
+    '/categories/3/questions',
+)
+
+
+def build_app(database_uri):
+    if database_uri is None:
+        return create_app()
+    return create_app({'SQLALCHEMY_DATABASE_URI': database_uri})
+
+
+def private_memory_kb():
+    fields = {}
+    with open('/proc/self/smaps_rollup') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+
+
+def serve(app):
+    client = app.test_client()
+    for path in REQUESTS:
+        client.get(path)
+
+
+def worker(write, started, app, database_uri):
+    if app is None:
+        app = build_app(database_uri)
+        warm_app(app)
+    else:
+        post_fork(app)
+    ready = time.perf_counter() - started
+    serve(app)
+    os.write(write, json.dumps({'ready': ready, 'uss_kb': private_memory_kb()}).encode())
+
+
+def run(workers, preload, database_uri):
+    app = None
+    master_started = time.perf_counter()
+    if preload:
+        app = build_app(database_uri)
+        warm_app(app)
+        gc.collect()
+        gc.freeze()
+    master_ready = time.perf_counter() - master_started
+
+    results = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        started = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            try:
+                worker(write, started, app, database_uri)
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            results.append(json.loads(pipe.read()))
+        os.waitpid(pid, 0)
+    if preload:
+        gc.unfreeze()
+    return master_ready, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--database-uri', default=None)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        master_ready, results = run(args.workers, preload, args.database_uri)
+        ready = sum(result['ready'] for result in results) / len(results)
+        uss = sum(result['uss_kb'] for result in results) / len(results)
+        print(f"{'preloaded' if preload else 'not preloaded':<14}"
+              f" master {master_ready * 1000:7.1f} ms"
+              f"  worker ready {ready * 1000:7.1f} ms"
+              f"  worker USS {uss / 1024:6.1f} MiB"
+              f"  total USS {uss * len(results) / 1024:6.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
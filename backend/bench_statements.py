@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: CPU per request for the hot read paths, building the
+query on every request (as the handlers used to) versus executing the
+prebuilt statements in statements.py.
+
+Runs against an in-memory SQLite database seeded with the test data, so it
+measures SQLAlchemy overhead rather than database time. Run from the
+backend directory:
+
+    python bench_statements.py [iterations]
+"""
+import sys
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, Question, Category
+import statements
+from seed_test_db import make_categories, make_questions
+
+
+class _App:
+    """Just enough of a Flask app for the seed helpers"""
+    def app_context(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def rebuilt(session):
+    session.query(Category).order_by(Category.type).all()
+    session.query(Question).order_by(Question.id).limit(10).offset(10).all()
+    session.query(Question).filter(Question.category == 3).order_by(Question.id).all()
+    session.query(Question).filter(Question.question.ilike('%title%')).order_by(
+        Question.id
+    ).all()
+    session.query(Question).filter(Question.id == 22).first()
+
+
+def prebuilt(session):
+    session.execute(statements.categories_by_type).scalars().all()
+    session.execute(statements.questions_page, {'limit': 10, 'offset': 10}).scalars().all()
+    session.execute(statements.questions_by_category, {'category_id': 3}).scalars().all()
+    session.execute(statements.questions_matching, {'pattern': '%title%'}).scalars().all()
+    session.execute(statements.question_by_id, {'question_id': 22}).scalar()
+
+
+def measure(engine, function, iterations):
+    with Session(engine) as session:
+        function(session)
+        start = time.process_time()
+        for _ in range(iterations):
+            function(session)
+            session.expunge_all()
+        return (time.process_time() - start) / iterations * 1e6
+
+
+def main(iterations=2000):
+    results = {}
+    for cache_size in (0, 500):
+        engine = create_engine('sqlite://', query_cache_size=cache_size)
+        db.metadata.create_all(engine, tables=[Question.__table__, Category.__table__])
+        with Session(engine) as session:
+            session.add_all(make_categories(_App()))
+            session.add_all(make_questions(_App()))
+            session.commit()
+        for name, function in (('rebuilt', rebuilt), ('prebuilt', prebuilt)):
+            results[(name, cache_size)] = measure(engine, function, iterations)
+        engine.dispose()
+
+    print(f'CPU per request (5 hot queries), {iterations} iterations')
+    for (name, cache_size), micros in results.items():
+        cache = 'compiled cache off' if cache_size == 0 else f'query_cache_size={cache_size}'
+        print(f'  {name:<9} {cache:<22} {micros:8.1f} us')
+    saved = results[('rebuilt', 500)] - results[('prebuilt', 500)]
+    print(f'  saved per request with prebuilt statements: {saved:.1f} us')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
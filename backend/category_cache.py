@@ -0,0 +1,67 @@
+import json
+import threading
+import time
+import zlib
+
+from sqlalchemy import select
+
+from models import db, Category
+
+"""
+CategoryCache
+    the formatted categories, held in memory and re-read from the (small)
+    categories table at most once per refresh_interval seconds; the cached
+    list is only replaced when the checksum of its content changes, so
+    renames are picked up as well as inserts and deletes.
+
+    version is a short checksum of the categories; clients that already hold
+    the categories compare it (sent as X-Categories-Version) instead of
+    downloading them again.
+"""
+class CategoryCache:
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._categories = []
+        self._by_id = {}
+        self._version = None
+        self._checked_at = 0.0
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._version is not None
+            and now - self._checked_at < self.refresh_interval
+        ):
+            return
+        with self._lock:
+            categories = [
+                category.format()
+                for category in db.session.execute(
+                    select(Category).order_by(Category.id)
+                ).scalars()
+            ]
+            self._checked_at = now
+            version = format(
+                zlib.crc32(json.dumps(categories, sort_keys=True).encode()), '08x'
+            )
+            if version == self._version and not force:
+                return
+            self._categories = categories
+            self._by_id = {category['id']: category for category in categories}
+            self._version = version
+
+    def categories(self):
+        """All categories ordered by id"""
+        self.refresh()
+        return list(self._categories)
+
+    def get(self, category_id):
+        self.refresh()
+        return self._by_id.get(category_id)
+
+    @property
+    def version(self):
+        self.refresh()
+        return self._version
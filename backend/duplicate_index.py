@@ -0,0 +1,279 @@
+import hashlib
+import random
+import re
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import select
+
+from models import db, Question, question_changes, question_watermark
+
+
+def normalize(text):
+    """Lowercase, strip accents and punctuation and collapse whitespace"""
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def shingles(normalized, size=4):
+    """The character size-grams of a normalized text"""
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+"""
+DuplicateIndex
+    a worker-local MinHash/LSH index over the question text, for finding
+    near-duplicate questions without comparing against the whole table.
+
+    Each question is normalized (case, accents, punctuation and whitespace
+    ignored) and reduced to a num_perm MinHash signature over its character
+    4-grams; each of the num_perm hash functions is the shingle's 64-bit
+    hash XORed with a fixed random mask. The signature is split into bands;
+    questions sharing any band are candidates, and candidates whose
+    estimated Jaccard similarity is at least threshold are duplicates.
+    Questions with identical normalized text are matched through a separate
+    exact lookup.
+
+    Like QuestionIndex, the index is loaded on first use, follows the
+    question_changes feed at most once per refresh_interval seconds, and
+    applies this worker's own writes immediately through apply().
+"""
+class DuplicateIndex:
+    def __init__(self, threshold=0.75, num_perm=64, bands=16, refresh_interval=1.0):
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.refresh_interval = refresh_interval
+        generator = random.Random(0x5EED)
+        self._masks = [generator.getrandbits(64) for _ in range(num_perm)]
+        self._lock = threading.RLock()
+        self._signatures = {}
+        self._keys = {}
+        self._buckets = {}
+        self._exact = {}
+        self._watermark = None
+        self._checked_at = 0.0
+
+    def __len__(self):
+        self.refresh()
+        return len(self._signatures)
+
+    def signature(self, normalized):
+        hashes = [
+            int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+            for shingle in shingles(normalized)
+        ]
+        return tuple(min(map(mask.__xor__, hashes)) for mask in self._masks)
+
+    def _band_keys(self, signature):
+        return [
+            (band, signature[band * self.rows:(band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._watermark is not None
+            and now - self._checked_at < self.refresh_interval
+        ):
+            return
+        with self._lock:
+            watermark = question_watermark()
+            self._checked_at = now
+            if watermark == self._watermark:
+                return
+            version, count = watermark
+            if self._watermark is not None:
+                changed = []
+                for question_id, (op, category, difficulty) in question_changes(
+                    self._watermark[0], version
+                ).items():
+                    if op == 'delete':
+                        self._remove(question_id)
+                    else:
+                        changed.append(question_id)
+                if changed:
+                    rows = db.session.execute(
+                        select(Question.id, Question.question).where(
+                            Question.id.in_(changed)
+                        )
+                    )
+                    for question_id, text in rows:
+                        self._add(question_id, text)
+                if len(self._signatures) == count:
+                    self._watermark = watermark
+                    return
+            self._load()
+            self._watermark = watermark
+
+    def rebuild(self):
+        """Discard the index and reload it from the questions table"""
+        with self._lock:
+            watermark = question_watermark()
+            self._load()
+            self._watermark = watermark
+            self._checked_at = time.monotonic()
+            return len(self._signatures)
+
+    def _load(self):
+        self._signatures = {}
+        self._keys = {}
+        self._buckets = {}
+        self._exact = {}
+        for question_id, text in db.session.execute(
+            select(Question.id, Question.question)
+        ):
+            self._add(question_id, text)
+
+    def _add(self, question_id, text):
+        self._remove(question_id)
+        normalized = normalize(text)
+        signature = self.signature(normalized)
+        keys = self._band_keys(signature)
+        self._signatures[question_id] = signature
+        self._keys[question_id] = (normalized, keys)
+        self._exact.setdefault(normalized, set()).add(question_id)
+        for key in keys:
+            self._buckets.setdefault(key, set()).add(question_id)
+
+    def _remove(self, question_id):
+        if question_id not in self._signatures:
+            return
+        del self._signatures[question_id]
+        normalized, keys = self._keys.pop(question_id)
+        self._discard(self._exact, normalized, question_id)
+        for key in keys:
+            self._discard(self._buckets, key, question_id)
+
+    def _discard(self, mapping, key, question_id):
+        ids = mapping.get(key)
+        if ids is not None:
+            ids.discard(question_id)
+            if not ids:
+                del mapping[key]
+
+    def _similarity(self, signature, other):
+        return sum(1 for a, b in zip(signature, other) if a == b) / self.num_perm
+
+    def apply(self, op, question):
+        """Listener for notify_question_change"""
+        with self._lock:
+            if self._watermark is None:
+                return
+            if op == 'delete':
+                self._remove(question['id'])
+            else:
+                self._add(question['id'], question['question'])
+            # the change row itself is picked up, idempotently, on the next refresh
+            version, count = self._watermark
+            self._watermark = (version, len(self._signatures))
+
+    def _matches(self, normalized, signature):
+        with self._lock:
+            matches = {question_id: 1.0 for question_id in self._exact.get(normalized, ())}
+            candidates = set()
+            for key in self._band_keys(signature):
+                candidates |= self._buckets.get(key, set())
+            for question_id in candidates - set(matches):
+                similarity = self._similarity(signature, self._signatures[question_id])
+                if similarity >= self.threshold:
+                    matches[question_id] = similarity
+        return matches
+
+    def _ranked(self, matches):
+        return [
+            {'id': question_id, 'similarity': round(similarity, 3)}
+            for question_id, similarity in sorted(
+                matches.items(), key=lambda match: (-match[1], match[0])
+            )
+        ]
+
+    def find(self, text, exclude=None):
+        """
+        Questions similar to text, most similar first, as a list of
+        {'id', 'similarity'}; exclude is a question id to leave out
+        """
+        self.refresh()
+        normalized = normalize(text)
+        matches = self._matches(normalized, self.signature(normalized))
+        matches.pop(exclude, None)
+        return self._ranked(matches)
+
+    def find_batch(self, texts, keep_duplicates=True):
+        """
+        find() for each (question_id, text) of a batch, also matching the
+        texts before it in the batch; with keep_duplicates False, texts that
+        matched are left out of that comparison, as if they were rejected.
+        Returns {question_id: matches} for the texts with any match
+        """
+        self.refresh()
+        found = {}
+        earlier = []
+        for question_id, text in texts:
+            normalized = normalize(text)
+            signature = self.signature(normalized)
+            matches = self._matches(normalized, signature)
+            matches.pop(question_id, None)
+            for other_id, other_normalized, other_signature in earlier:
+                if normalized == other_normalized:
+                    similarity = 1.0
+                else:
+                    similarity = self._similarity(signature, other_signature)
+                if similarity >= self.threshold:
+                    matches[other_id] = max(matches.get(other_id, 0.0), similarity)
+            if matches:
+                found[question_id] = self._ranked(matches)
+            if keep_duplicates or not matches:
+                earlier.append((question_id, normalized, signature))
+        return found
+
+    def clusters(self):
+        """Groups of two or more mutually reachable near-duplicates, as sorted id lists"""
+        self.refresh()
+        with self._lock:
+            parents = {}
+
+            def root(question_id):
+                while parents.get(question_id, question_id) != question_id:
+                    question_id = parents[question_id]
+                return question_id
+
+            def join(a, b):
+                a, b = root(a), root(b)
+                if a != b:
+                    parents[max(a, b)] = min(a, b)
+
+            for ids in self._exact.values():
+                first = min(ids)
+                for question_id in ids:
+                    join(first, question_id)
+            compared = set()
+            for ids in self._buckets.values():
+                if len(ids) < 2:
+                    continue
+                ids = sorted(ids)
+                for position, a in enumerate(ids):
+                    for b in ids[position + 1:]:
+                        if (a, b) in compared:
+                            continue
+                        compared.add((a, b))
+                        if self._similarity(
+                            self._signatures[a], self._signatures[b]
+                        ) >= self.threshold:
+                            join(a, b)
+            groups = {}
+            for question_id in self._signatures:
+                groups.setdefault(root(question_id), []).append(question_id)
+        return sorted(
+            (sorted(ids) for ids in groups.values() if len(ids) > 1),
+            key=lambda ids: ids[0],
+        )
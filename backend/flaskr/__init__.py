@@ -1,24 +1,173 @@
-from flask import Flask, request, abort, jsonify
+from flask import Flask, request, abort, jsonify, send_file
+from werkzeug.exceptions import Conflict
 from flask_cors import CORS
+import hmac
+import os
 import random
-from models import setup_db, Question, Category, db
+import tempfile
+from models import setup_db, Question, QuestionChange, Job, db
+from question_index import QuestionIndex
+from question_pools import QuestionPools
+from duplicate_index import DuplicateIndex
+from category_cache import CategoryCache
+from question_stats import QuestionStats
+from answer_buffer import AnswerBuffer
+from jobs import JobRunner, JOB_KINDS, export_path, valid_params
+import statements
+from resilience import CircuitBreaker, ResponseCache, Resilience, DATABASE_UNAVAILABLE
+from slow_queries import SlowQueryLog
 
 QUESTIONS_PER_PAGE = 10
+QUESTIONS_INCLUDE = ("categories", "current_category", "total_questions")
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
 
+    app.config.setdefault("DB_CREATE_ALL", True)
+    app.config.setdefault("QUESTION_INDEX_REFRESH_SECONDS", 1.0)
+    app.config.setdefault("QUESTION_POOLS_MODE", "local")
+    app.config.setdefault("QUESTION_POOLS_NAME", "trivia_question_pools")
+    app.config.setdefault("QUESTION_POOLS_DIR", None)
+    app.config.setdefault("QUESTION_CHANGES_PER_PAGE", 100)
+    app.config.setdefault("QUESTION_CHANGES_MAX_PER_PAGE", 1000)
+    app.config.setdefault("ANSWER_FLUSH_SIZE", 100)
+    app.config.setdefault("ANSWER_FLUSH_SECONDS", 1.0)
+    app.config.setdefault("ANSWER_BUFFER_MAX", 10000)
+    app.config.setdefault("LEADERBOARD_REFRESH_SECONDS", 30.0)
+    app.config.setdefault("JOB_WORKERS", 2)
+    app.config.setdefault("JOB_MAX_PENDING", 20)
+    app.config.setdefault(
+        "JOB_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "trivia_exports")
+    )
+    app.config.setdefault("DB_TIMEOUT_MS", 2000)
+    app.config.setdefault("DB_ENDPOINT_TIMEOUTS_MS", {})
+    app.config.setdefault("CIRCUIT_FAILURE_THRESHOLD", 5)
+    app.config.setdefault("CIRCUIT_RESET_SECONDS", 10.0)
+    app.config.setdefault("STALE_CACHE_ENTRIES", 256)
+    app.config.setdefault("BULK_MAX_QUESTIONS", 500)
+    app.config.setdefault("SLOW_QUERY_MS", 200)
+    app.config.setdefault("SLOW_QUERY_EXPLAIN_RATE", 0.1)
+    app.config.setdefault("SLOW_QUERY_LOG_SIZE", 100)
+    app.config.setdefault("SLOW_QUERY_LOG_FILE", None)
+    app.config.setdefault("SLOW_QUERY_REDACT_PARAMETERS", True)
+    app.config.setdefault("ADMIN_TOKEN", None)
+    app.config.setdefault("DUPLICATE_QUESTION_POLICY", "reject")
+    app.config.setdefault("DUPLICATE_QUESTION_THRESHOLD", 0.75)
+    app.config.setdefault("STATS_LENGTH_BUCKET", 20)
+
     if test_config is None:
-        setup_db(app)
+        # FLASK_-prefixed environment variables override the defaults above,
+        # e.g. FLASK_QUESTION_POOLS_MODE=shm; values are parsed as JSON
+        app.config.from_prefixed_env()
+        setup_db(app, create_all=app.config["DB_CREATE_ALL"])
     else:
+        app.config.from_mapping(test_config)
         database_path = test_config.get("SQLALCHEMY_DATABASE_URI")
-        setup_db(app, database_path=database_path)
+        setup_db(
+            app, database_path=database_path, create_all=app.config["DB_CREATE_ALL"]
+        )
+
+    """
+    Keep an (id, category, difficulty) index of the questions so that quiz
+    selection and counts are answered without a query. With
+    QUESTION_POOLS_MODE set to "shm" (or "mmap" with QUESTION_POOLS_DIR) the
+    index is published once into a segment shared by all workers.
+    """
+    pools = None
+    if app.config["QUESTION_POOLS_MODE"] == "shm":
+        pools = QuestionPools(name=app.config["QUESTION_POOLS_NAME"])
+    elif app.config["QUESTION_POOLS_MODE"] == "mmap":
+        pools = QuestionPools(directory=app.config["QUESTION_POOLS_DIR"])
+    app.extensions["question_pools"] = pools
+    question_index = QuestionIndex(
+        refresh_interval=app.config["QUESTION_INDEX_REFRESH_SECONDS"],
+        pools=pools,
+    )
+    app.extensions["question_index"] = question_index
+    app.extensions.setdefault("question_listeners", []).append(question_index.apply)
+
+    """
+    Keep a MinHash/LSH index of the question text so that new and edited
+    questions can be checked for near-duplicates without scanning the table.
+    DUPLICATE_QUESTION_POLICY is "reject", "flag" or "off".
+    """
+    duplicate_index = DuplicateIndex(
+        threshold=app.config["DUPLICATE_QUESTION_THRESHOLD"],
+        refresh_interval=app.config["QUESTION_INDEX_REFRESH_SECONDS"],
+    )
+    app.extensions["duplicate_index"] = duplicate_index
+    app.extensions["question_listeners"].append(duplicate_index.apply)
+    duplicate_policy = app.config["DUPLICATE_QUESTION_POLICY"]
+
+    category_cache = CategoryCache(
+        refresh_interval=app.config["QUESTION_INDEX_REFRESH_SECONDS"]
+    )
+    app.extensions["category_cache"] = category_cache
+
+    question_stats = QuestionStats(
+        refresh_interval=app.config["QUESTION_INDEX_REFRESH_SECONDS"]
+    )
+    app.extensions["question_stats"] = question_stats
+    app.extensions["question_listeners"].append(question_stats.invalidate)
+
+    answer_buffer = AnswerBuffer(
+        app,
+        flush_size=app.config["ANSWER_FLUSH_SIZE"],
+        flush_interval=app.config["ANSWER_FLUSH_SECONDS"],
+        refresh_interval=app.config["LEADERBOARD_REFRESH_SECONDS"],
+        max_pending=app.config["ANSWER_BUFFER_MAX"],
+    )
+    app.extensions["answer_buffer"] = answer_buffer
+
+    job_runner = JobRunner(
+        app,
+        max_workers=app.config["JOB_WORKERS"],
+        max_pending=app.config["JOB_MAX_PENDING"],
+    )
+    for kind, function in JOB_KINDS.items():
+        job_runner.register(kind, function)
+    app.extensions["job_runner"] = job_runner
+
+    """
+    Guard database access with a circuit breaker and per-endpoint statement
+    timeouts. While the database is failing, the read endpoints serve their
+    last good response marked stale and everything else fails fast with 503.
+    """
+    resilience = Resilience(
+        app,
+        CircuitBreaker(
+            failure_threshold=app.config["CIRCUIT_FAILURE_THRESHOLD"],
+            reset_timeout=app.config["CIRCUIT_RESET_SECONDS"],
+        ),
+        ResponseCache(max_entries=app.config["STALE_CACHE_ENTRIES"]),
+        timeout_ms=app.config["DB_TIMEOUT_MS"],
+        endpoint_timeouts_ms=app.config["DB_ENDPOINT_TIMEOUTS_MS"],
+    )
+    with app.app_context():
+        resilience.install(db.engine)
+    app.extensions["resilience"] = resilience
+
+    """
+    Record statements slower than SLOW_QUERY_MS (None turns this off),
+    with a sampled EXPLAIN (ANALYZE, BUFFERS) plan on Postgres.
+    """
+    slow_query_log = SlowQueryLog(
+        threshold_ms=app.config["SLOW_QUERY_MS"],
+        explain_rate=app.config["SLOW_QUERY_EXPLAIN_RATE"],
+        max_entries=app.config["SLOW_QUERY_LOG_SIZE"],
+        log_path=app.config["SLOW_QUERY_LOG_FILE"],
+        redact_parameters=app.config["SLOW_QUERY_REDACT_PARAMETERS"],
+    )
+    if app.config["SLOW_QUERY_MS"] is not None:
+        with app.app_context():
+            slow_query_log.install(db.engine)
+    app.extensions["slow_query_log"] = slow_query_log
 
     """
     Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
     """
-    CORS(app, origins=["*"])
+    CORS(app, origins=["*"], expose_headers=["X-Categories-Version"])
 
     """
     Use the after_request decorator to set Access-Control-Allow
@@ -40,12 +189,15 @@ def create_app(test_config=None):
     """
 
     @app.route("/categories")
+    @resilience.guard(stale=True)
     def get_categories():
-        res = Category.query.order_by(Category.type).all()
+        res = db.session.execute(statements.categories_by_type).scalars()
         categories = [category.format() for category in res]
         if len(categories) == 0:
             return abort(404)
-        return jsonify({"success": True, "categories": categories})
+        response = jsonify({"success": True, "categories": categories})
+        response.headers["X-Categories-Version"] = category_cache.version
+        return response
 
     """
     Create an endpoint to handle GET requests for questions,
@@ -57,41 +209,45 @@ def create_app(test_config=None):
     you should see questions and categories generated,
     ten questions per page and pagination at the bottom of the screen for three pages.
     Clicking on the page numbers should update the questions.
+
+    `include` is a comma separated subset of QUESTIONS_INCLUDE (default: all)
+    so that clients can skip the parts they already hold; the
+    X-Categories-Version header tells them when their categories are stale.
     """
 
-    @app.route("/questions", methods=["GET", "POST"])
+    @app.route("/questions", methods=["GET", "POST", "DELETE", "PATCH"])
+    @resilience.guard(stale=True)
     def get_questions():
         if request.method == "GET":
             page = request.args.get("page", 1, type=int)
-            res = Question.query.order_by(Question.id).all()
-            count = Question.query.count()
+            if page < 1:
+                abort(404)
+            res = db.session.execute(
+                statements.questions_page,
+                {
+                    "limit": QUESTIONS_PER_PAGE,
+                    "offset": (page - 1) * QUESTIONS_PER_PAGE,
+                },
+            ).scalars()
+            include = request.args.get("include", None)
+            if include is None:
+                include = QUESTIONS_INCLUDE
+            else:
+                include = [part.strip() for part in include.split(",")]
             questions = [question.format() for question in res]
-            categories = (
-                Category.query.order_by(Category.id)
-                .all()
-            )
-            categories = [category.format() for category in categories]
-            start = (page - 1) * QUESTIONS_PER_PAGE
-            end = start + QUESTIONS_PER_PAGE
-            questions = questions[start:end]
             if len(questions) == 0:
                 abort(404)
-            current_category = [
-                category
-                for category in categories
-                if category["id"] == questions[0]["category"]
-            ]
 
-            current_category = current_category[0]
-            return jsonify(
-                {
-                    "success": True,
-                    "questions": questions,
-                    "total_questions": count,
-                    "categories": [category for category in categories],
-                    "current_category": current_category,
-                }
-            )
+            data = {"success": True, "questions": questions}
+            if "total_questions" in include:
+                data["total_questions"] = question_index.count()
+            if "categories" in include:
+                data["categories"] = category_cache.categories()
+            if "current_category" in include:
+                data["current_category"] = category_cache.get(questions[0]["category"])
+            response = jsonify(data)
+            response.headers["X-Categories-Version"] = category_cache.version
+            return response
         if request.method == "POST":
             """
             Create an endpoint to POST a new question,
@@ -117,12 +273,171 @@ def create_app(test_config=None):
                 difficulty=body.get("difficulty"),
                 question=body.get("question"),
             )
-            if Category.query.filter(Category.id == question.category).count() == 0:
+            if not question_index.has_category(question.category):
                 abort(400)
+            if duplicate_policy == "off":
+                question.insert()
+                return jsonify({"success": True, "question": question.format()}), 201
+            duplicates = duplicate_index.find(question.question)
+            if duplicates and duplicate_policy == "reject":
+                error = Conflict()
+                error.duplicates = duplicates
+                raise error
             question.insert()
-            return jsonify({"success": True, "question": question.format()}), 201
+            return jsonify(
+                {
+                    "success": True,
+                    "question": question.format(),
+                    "duplicates": duplicates,
+                }
+            ), 201
+        if request.method in ("DELETE", "PATCH"):
+            """
+            Create endpoints to DELETE or PATCH a batch of questions.
+            Each batch is applied with a single statement; items carrying a
+            version are only changed if the question is still at that version.
+            """
+            body = request.get_json()
+            items = body.get("questions", None) if isinstance(body, dict) else None
+            if (
+                not isinstance(items, list)
+                or not 0 < len(items) <= app.config["BULK_MAX_QUESTIONS"]
+                or not all(valid_bulk_item(item, request.method) for item in items)
+                or len({item["id"] for item in items}) != len(items)
+            ):
+                abort(400)
+
+            if request.method == "DELETE":
+                results = Question.bulk_delete(items)
+            else:
+                results = update_questions(items)
+            return jsonify({"success": True, "results": results})
         abort(405)
 
+    def update_questions(items):
+        """
+        Question.bulk_update, except that items whose new text duplicates
+        another question, or an earlier item of the batch, are reported
+        (DUPLICATE_QUESTION_POLICY "reject": skipped with status "duplicate")
+        with the questions they duplicate
+        """
+        duplicates = {}
+        if duplicate_policy != "off":
+            duplicates = duplicate_index.find_batch(
+                [(item["id"], item["question"]) for item in items if "question" in item],
+                keep_duplicates=duplicate_policy != "reject",
+            )
+        rejected = duplicates if duplicate_policy == "reject" else {}
+        accepted = [item for item in items if item["id"] not in rejected]
+        results = {
+            result["id"]: result
+            for result in (Question.bulk_update(accepted) if accepted else [])
+        }
+        for item in items:
+            if item["id"] in rejected:
+                results[item["id"]] = {
+                    "id": item["id"],
+                    "status": "duplicate",
+                    "version": None,
+                }
+            if item["id"] in duplicates:
+                results[item["id"]]["duplicates"] = duplicates[item["id"]]
+        return [results[item["id"]] for item in items]
+
+    def is_integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    def valid_bulk_item(item, method):
+        if (
+            not isinstance(item, dict)
+            or not is_integer(item.get("id", None))
+            or not (item.get("version") is None or is_integer(item["version"]))
+        ):
+            return False
+        if method == "DELETE":
+            return set(item) <= {"id", "version"}
+        changes = set(item) - {"id", "version"}
+        if not changes or not changes <= set(Question.UPDATABLE):
+            return False
+        if not all(isinstance(item.get(field, ""), str) for field in ("question", "answer")):
+            return False
+        if not all(is_integer(item.get(field, 0)) for field in ("category", "difficulty")):
+            return False
+        return "category" not in item or question_index.has_category(item["category"])
+
+    """
+    Create an endpoint to GET the clusters of near-duplicate questions
+    currently in the table, for auditing.
+    """
+    @app.route("/questions/duplicates")
+    @resilience.guard()
+    def get_duplicate_questions():
+        clusters = duplicate_index.clusters()
+        ids = [question_id for cluster in clusters for question_id in cluster]
+        questions = {}
+        if ids:
+            questions = {
+                question.id: question.format()
+                for question in db.session.query(Question)
+                .filter(Question.id.in_(ids))
+                .all()
+            }
+        return jsonify(
+            {
+                "success": True,
+                "clusters": [
+                    [
+                        questions[question_id]
+                        for question_id in cluster
+                        if question_id in questions
+                    ]
+                    for cluster in clusters
+                ],
+                "total_clusters": len(clusters),
+            }
+        )
+
+    """
+    Create an endpoint to GET the question change feed.
+    Returns the inserts, updates and deletes recorded after the `since`
+    version, oldest first, in batches of at most `limit` changes, so that
+    clients and caches can sync incrementally instead of re-reading /questions.
+    """
+    @app.route("/questions/changes")
+    @resilience.guard()
+    def get_question_changes():
+        since = request.args.get("since", 0, type=int)
+        limit = request.args.get(
+            "limit", app.config["QUESTION_CHANGES_PER_PAGE"], type=int
+        )
+        limit = max(1, min(limit, app.config["QUESTION_CHANGES_MAX_PER_PAGE"]))
+        rows = (
+            db.session.query(QuestionChange, Question)
+            .outerjoin(Question, Question.id == QuestionChange.question_id)
+            .filter(QuestionChange.version > since)
+            .order_by(QuestionChange.version)
+            .limit(limit + 1)
+            .all()
+        )
+        has_more = len(rows) > limit
+        changes = []
+        for change, question in rows[:limit]:
+            change = change.format()
+            change["question"] = (
+                question.format()
+                if question is not None and change["op"] != "delete"
+                else None
+            )
+            changes.append(change)
+        return jsonify(
+            {
+                "success": True,
+                "changes": changes,
+                "version": changes[-1]["version"] if changes else since,
+                "has_more": has_more,
+            }
+        )
+
     """
     Create an endpoint to DELETE question using a question ID.
 
@@ -130,12 +445,15 @@ def create_app(test_config=None):
     This removal will persist in the database and when you refresh the page.
     """
     @app.route("/questions/<int:question_id>", methods=["DELETE"])
+    @resilience.guard()
     def delete_question(question_id):
         if not isinstance(question_id, int):
             abort(400)
-        question: Question = Question.query.filter(
-            Question.id == question_id
-        ).first_or_404()
+        question: Question = db.session.execute(
+            statements.question_by_id, {"question_id": question_id}
+        ).scalar()
+        if question is None:
+            abort(404)
         id = question.id
         question.delete()
 
@@ -151,23 +469,24 @@ def create_app(test_config=None):
     Try using the word "title" to start.
     """
     @app.route("/questions/search", methods=["POST"])
+    @resilience.guard()
     def lookup_question():
         body = request.get_json()
         if not body or not isinstance(body.get("search_term", None), str):
             abort(400)
         search_term = body.get("search_term")
         search_term = f"%{search_term}%"
-        questions = (
-            Question.query.filter(Question.question.ilike(search_term))
-            .order_by(Question.id)
-            .all()
-        )
+        questions = db.session.execute(
+            statements.questions_matching, {"pattern": search_term}
+        ).scalars().all()
         count = len(questions)
         if(count == 0):
             abort(404)
-        current_category = Category.query.filter(
-            Category.id == questions[0].category
-        ).one_or_404()
+        current_category = db.session.execute(
+            statements.category_by_id, {"category_id": questions[0].category}
+        ).scalar()
+        if current_category is None:
+            abort(404)
 
         return (
             jsonify(
@@ -189,11 +508,18 @@ def create_app(test_config=None):
     category to be shown.
     """
     @app.route("/categories/<int:category_id>/questions")
+    @resilience.guard(stale=True)
     def get_questions_by_category(category_id: int):
-        category = Category.query.filter(Category.id == category_id).first_or_404()
+        category = db.session.execute(
+            statements.category_by_id, {"category_id": category_id}
+        ).scalar()
+        if category is None:
+            abort(404)
         current_category = category
-        count = Question.query.filter(Question.category == category_id).count()
-        questions = Question.query.filter(Question.category == category_id).order_by(Question.id).all()
+        count = question_index.count(category_id)
+        questions = db.session.execute(
+            statements.questions_by_category, {"category_id": category_id}
+        ).scalars().all()
         if len(questions) == 0:
             abort(404)
         return jsonify({
@@ -214,6 +540,7 @@ def create_app(test_config=None):
     and shown whether they were correct or not.
     """
     @app.route("/quizzes", methods=["POST"])
+    @resilience.guard()
     def lookup_quiz_question():
         body = request.get_json()
         if (
@@ -225,19 +552,206 @@ def create_app(test_config=None):
 
         quiz_category = body.get("quiz_category")
         previous_questions = body.get("previous_questions")
+        difficulty = body.get("difficulty", None)
+        if difficulty is not None and not isinstance(difficulty, int):
+            abort(400)
 
-        questions = Question.query.filter(Question.id.not_in(previous_questions)).all()
         if quiz_category > 0:
-            if Category.query.filter(Category.id == quiz_category).count() < 1:
+            if not question_index.has_category(quiz_category):
                 abort(400)
-            questions = [question for question in questions if question.category == quiz_category]
+        else:
+            quiz_category = None
 
+        question_ids = question_index.select(
+            category=quiz_category,
+            difficulty=difficulty,
+            exclude=previous_questions,
+        )
+
+        # the index may be a little behind: drop ids deleted since and pick again
         question = None
-        if len(questions) > 0:
-            question = random.choice([question.format() for question in questions])
+        while question is None and question_ids:
+            question_id = question_ids.pop(random.randrange(len(question_ids)))
+            question = db.session.execute(
+                statements.question_by_id, {"question_id": question_id}
+            ).scalar()
+            if question is None:
+                question_index.apply("delete", {"id": question_id})
+        if question is not None:
+            question = question.format()
 
         return jsonify({"success": True, "question": question}), 200
 
+    """
+    Create a POST endpoint to record an answered quiz question.
+    Answers are buffered and written in batches, so the response is
+    202 Accepted rather than 201 Created. While the database is down the
+    quiz category cannot be checked and the answer is buffered as given,
+    until ANSWER_BUFFER_MAX answers are waiting and new answers get 503.
+    """
+    @app.route("/quizzes/answers", methods=["POST"])
+    def record_quiz_answer():
+        body = request.get_json()
+        if (
+            not body
+            or not isinstance(body.get("question_id", None), int)
+            or not isinstance(body.get("correct", None), bool)
+            or not isinstance(body.get("player", "anonymous"), str)
+            or not isinstance(body.get("quiz_category", 0), int)
+        ):
+            abort(400)
+
+        player = body.get("player", "anonymous").strip()[:80] or "anonymous"
+        quiz_category = body.get("quiz_category", 0)
+        if quiz_category > 0:
+            try:
+                if not question_index.has_category(quiz_category):
+                    abort(400)
+            except DATABASE_UNAVAILABLE:
+                pass
+        else:
+            quiz_category = None
+
+        if answer_buffer.full():
+            abort(503, retry_after=max(1, round(answer_buffer.flush_interval)))
+        answer_buffer.add(
+            player=player,
+            question_id=body.get("question_id"),
+            correct=body.get("correct"),
+            category=quiz_category,
+        )
+        return jsonify({"success": True}), 202
+
+    """
+    Create a GET endpoint for the quiz leaderboard and answer statistics.
+    """
+    @app.route("/quizzes/leaderboard")
+    @resilience.guard()
+    def get_leaderboard():
+        limit = max(1, min(request.args.get("limit", 10, type=int), 100))
+        return jsonify(
+            {
+                "success": True,
+                "leaderboard": answer_buffer.leaderboard(limit),
+                **answer_buffer.stats(),
+            }
+        )
+
+    """
+    Admin endpoints only exist when ADMIN_TOKEN is set, and need it as
+    "Authorization: Bearer <ADMIN_TOKEN>". A token set from the environment
+    may have been parsed as a number, so it is compared as a string.
+    """
+    def require_admin():
+        token = app.config["ADMIN_TOKEN"]
+        if not token:
+            abort(404)
+        scheme, _, given = request.headers.get("Authorization", "").partition(" ")
+        if scheme != "Bearer" or not hmac.compare_digest(given.encode(), str(token).encode()):
+            abort(401)
+
+    """
+    Create endpoints to submit maintenance jobs, follow their progress
+    and cancel them. Jobs run on a bounded thread pool, off the request path.
+    They rewrite or export the whole question bank, so like the other admin
+    endpoints they need ADMIN_TOKEN.
+    """
+    @app.route("/jobs", methods=["POST"])
+    @resilience.guard()
+    def submit_job():
+        require_admin()
+        body = request.get_json()
+        if (
+            not body
+            or body.get("kind", None) not in job_runner.kinds
+            or not isinstance(body.get("params", {}), dict)
+        ):
+            abort(400)
+        kind = body.get("kind")
+        params = body.get("params", {})
+        if not valid_params(kind, params):
+            abort(400)
+        if job_runner.full():
+            abort(429)
+
+        job = job_runner.submit(kind, params)
+        return jsonify({"success": True, "job": job.format()}), 202
+
+    @app.route("/jobs/<int:job_id>", methods=["GET", "DELETE"])
+    @resilience.guard()
+    def get_job(job_id):
+        require_admin()
+        job = Job.query.filter(Job.id == job_id).first_or_404()
+        if request.method == "DELETE":
+            if job.status not in ("queued", "running"):
+                abort(422)
+            job_runner.cancel(job)
+        return jsonify({"success": True, "job": job.format()})
+
+    @app.route("/jobs/<int:job_id>/export")
+    @resilience.guard()
+    def get_job_export(job_id):
+        require_admin()
+        job = Job.query.filter(Job.id == job_id).first_or_404()
+        path = export_path(app, job.id)
+        if job.kind != "export" or job.status != "succeeded" or not os.path.exists(path):
+            abort(404)
+        return send_file(
+            path, mimetype="application/x-ndjson", download_name=f"export-{job.id}.jsonl"
+        )
+
+    """
+    Create a GET endpoint for dashboard statistics: question counts by
+    category and difficulty, and a histogram of question length in buckets
+    of `bucket` characters, all from one cached GROUP BY.
+    """
+    @app.route("/stats")
+    @resilience.guard(stale=True)
+    def get_stats():
+        bucket = request.args.get("bucket", app.config["STATS_LENGTH_BUCKET"], type=int)
+        if bucket < 1:
+            abort(400)
+        summary = question_stats.summary(bucket)
+        by_category = {}
+        by_difficulty = {}
+        for row in summary["counts"]:
+            by_category[row["category"]] = by_category.get(row["category"], 0) + row["count"]
+            by_difficulty[row["difficulty"]] = (
+                by_difficulty.get(row["difficulty"], 0) + row["count"]
+            )
+        return jsonify(
+            {
+                "success": True,
+                "total_questions": sum(by_category.values()),
+                "counts": summary["counts"],
+                "categories": [
+                    dict(category, count=by_category.get(category["id"], 0))
+                    for category in category_cache.categories()
+                ],
+                "difficulties": [
+                    {"difficulty": difficulty, "count": count}
+                    for difficulty, count in sorted(by_difficulty.items())
+                ],
+                "bucket": bucket,
+                "length_histogram": summary["length_histogram"],
+            }
+        )
+
+    """
+    Create a GET endpoint for the most recent slow queries, newest first.
+    """
+    @app.route("/admin/slow-queries")
+    def get_slow_queries():
+        require_admin()
+        limit = request.args.get("limit", None, type=int)
+        return jsonify(
+            {
+                "success": True,
+                "threshold_ms": slow_query_log.threshold_ms,
+                "queries": slow_query_log.entries(limit),
+            }
+        )
+
     """
     Create error handlers for all expected errors
     including 404 and 422.
@@ -246,6 +760,10 @@ def create_app(test_config=None):
     def bad_request(error):
         return jsonify({"success": False, "error": "Bad Request"}), 400
 
+    @app.errorhandler(401)
+    def unauthorized(error):
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+
     @app.errorhandler(404)
     def not_found(error):
         return jsonify({"success": False, "error": "Not Found"}), 404
@@ -254,6 +772,13 @@ def create_app(test_config=None):
     def not_allowed(error):
         return jsonify({"success": False, "error": "Method Not Allowed"}), 405
 
+    @app.errorhandler(409)
+    def conflict(error):
+        data = {"success": False, "error": "Conflict"}
+        if getattr(error, "duplicates", None) is not None:
+            data["duplicates"] = error.duplicates
+        return jsonify(data), 409
+
     @app.errorhandler(415)
     def unsupported_media_type(error):
         return jsonify({"success": False, "error": "Unsupported Media Type"}), 415
@@ -262,8 +787,46 @@ def create_app(test_config=None):
     def unsupported_media_type(error):
         return jsonify({"success": False, "error": "Unprocessable Content"}), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({"success": False, "error": "Too Many Requests"}), 429
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        response = jsonify({"success": False, "error": "Service Unavailable"})
+        if getattr(error, "retry_after", None) is not None:
+            response.headers["Retry-After"] = str(error.retry_after)
+        return response, 503
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return jsonify({"success": False, "error": "Internal Server Error"}), 500
 
     return app
+
+
+"""
+warm_app(app)
+    builds the in-memory caches and closes every database connection, so
+    that a preloading server (gunicorn --preload) can fork workers that
+    share the warmed caches copy-on-write and no connection
+"""
+def warm_app(app):
+    with app.app_context():
+        app.extensions["question_index"].refresh(force=True)
+        app.extensions["category_cache"].refresh(force=True)
+        app.extensions["duplicate_index"].refresh(force=True)
+        db.session.remove()
+        db.engine.dispose()
+
+
+"""
+post_fork(app)
+    runs in each forked worker: gives it a fresh connection pool (without
+    closing the parent's connections) and fresh background thread state
+"""
+def post_fork(app):
+    with app.app_context():
+        db.engine.dispose(close=False)
+    app.extensions["answer_buffer"].after_fork()
+    app.extensions["job_runner"].after_fork()
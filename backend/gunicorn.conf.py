@@ -0,0 +1,13 @@
+import os
+
+bind = os.environ.get("BIND", "127.0.0.1:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+threads = int(os.environ.get("THREADS", 4))
+preload_app = os.environ.get("PRELOAD", "1") == "1"
+
+
+def post_fork(server, worker):
+    import wsgi
+    from flaskr import post_fork
+
+    post_fork(wsgi.app)
@@ -0,0 +1,263 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import threading
+
+from sqlalchemy import select, update
+
+from models import db, Job, Question, Category
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+"""
+JobContext
+    handed to a running job so it can report progress and notice cancellation
+"""
+class JobContext:
+    def __init__(self, app, job_id, event):
+        self.app = app
+        self.job_id = job_id
+        self._event = event
+
+    def progress(self, done, total=None):
+        """Record progress and raise JobCancelled if cancellation was requested"""
+        values = {'progress': done}
+        if total is not None:
+            values['total'] = total
+        db.session.execute(update(Job).where(Job.id == self.job_id).values(**values))
+        db.session.commit()
+        self.check()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+        # cancellation may have been requested through another worker
+        cancel_requested = db.session.execute(
+            select(Job.cancel_requested).where(Job.id == self.job_id)
+        ).scalar()
+        if cancel_requested:
+            raise JobCancelled()
+
+
+"""
+JobRunner
+    runs maintenance jobs on a bounded thread pool, off the request path.
+    Each job's state lives in the jobs table so that any worker can report it;
+    at most max_pending jobs may be queued or running in this worker.
+"""
+class JobRunner:
+    def __init__(self, app, max_workers=2, max_pending=20):
+        self.app = app
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.kinds = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}
+        self._events = {}
+
+    def register(self, kind, function):
+        self.kinds[kind] = function
+
+    def full(self):
+        with self._lock:
+            return len(self._futures) >= self.max_pending
+
+    def submit(self, kind, params):
+        job = Job(kind=kind, params=params)
+        job.insert()
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='job'
+                )
+            event = threading.Event()
+            self._events[job.id] = event
+            self._futures[job.id] = self._executor.submit(
+                self._run, job.id, kind, params, event
+            )
+        return job
+
+    def cancel(self, job):
+        """Cancel a queued job outright, or ask a running one to stop"""
+        job.cancel_requested = True
+        with self._lock:
+            future = self._futures.get(job.id)
+            event = self._events.get(job.id)
+        if event is not None:
+            event.set()
+        if future is not None and future.cancel():
+            self._finish(job.id)
+            job.status = 'cancelled'
+            job.finished_at = _now()
+        job.update()
+
+    def _finish(self, job_id):
+        with self._lock:
+            self._futures.pop(job_id, None)
+            self._events.pop(job_id, None)
+
+    def _set(self, job_id, **values):
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+
+    def _run(self, job_id, kind, params, event):
+        with self.app.app_context():
+            context = JobContext(self.app, job_id, event)
+            try:
+                context.check()
+                self._set(job_id, status='running', started_at=_now())
+                result = self.kinds[kind](context, **params)
+            except JobCancelled:
+                db.session.rollback()
+                self._set(job_id, status='cancelled', finished_at=_now())
+            except Exception as error:
+                logger.exception('job %s (%s) failed', job_id, kind)
+                db.session.rollback()
+                self._set(
+                    job_id, status='failed', error=str(error)[:500], finished_at=_now()
+                )
+            else:
+                self._set(
+                    job_id,
+                    status='succeeded',
+                    result=json.dumps(result),
+                    finished_at=_now(),
+                )
+            finally:
+                db.session.remove()
+                self._finish(job_id)
+
+    def after_fork(self):
+        """Drop the executor and futures inherited from the parent process"""
+        self._lock = threading.Lock()
+        self._executor = None
+        self._futures = {}
+        self._events = {}
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+"""
+Maintenance jobs. Each takes the JobContext plus the job's params and
+returns a small JSON-serialisable result.
+"""
+def reseed(context):
+    """Restore any seed category or question that is missing, by id"""
+    from seed_test_db import make_categories, make_questions
+
+    categories = make_categories(context.app)
+    questions = make_questions(context.app)
+    existing_categories = set(db.session.execute(select(Category.id)).scalars())
+    existing_questions = set(db.session.execute(select(Question.id)).scalars())
+    total = len(categories) + len(questions)
+    restored = 0
+    for done, category in enumerate(categories, start=1):
+        if category.id not in existing_categories:
+            db.session.add(category)
+            restored += 1
+        context.progress(done, total)
+    db.session.commit()
+    for done, question in enumerate(questions, start=len(categories) + 1):
+        if question.id not in existing_questions:
+            question.insert()
+            restored += 1
+        context.progress(done, total)
+    return {'restored': restored}
+
+
+def reindex(context):
+    """Rebuild the question and duplicate indexes (and the shared pools, if enabled)"""
+    context.progress(0, 1)
+    count = context.app.extensions['question_index'].rebuild()
+    context.app.extensions['duplicate_index'].rebuild()
+    context.progress(1, 1)
+    return {'questions': count}
+
+
+def reconcile(context):
+    """Flush buffered quiz answers and recompute the leaderboard counters"""
+    context.progress(0, 1)
+    stats = context.app.extensions['answer_buffer'].reconcile()
+    context.progress(1, 1)
+    return stats
+
+
+def export_path(app, job_id):
+    return os.path.join(app.config['JOB_EXPORT_DIR'], f'export-{job_id}.jsonl')
+
+
+def export(context, batch_size=100):
+    """
+    Write every question, formatted, one JSON object per line, to the
+    JOB_EXPORT_DIR file for this job, reading batch_size rows at a time
+    """
+    total = db.session.execute(select(db.func.count(Question.id))).scalar()
+    path = export_path(context.app, context.job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    exported = 0
+    last_id = 0
+    try:
+        with open(temporary, 'w') as file:
+            while True:
+                batch = db.session.execute(
+                    select(Question)
+                    .where(Question.id > last_id)
+                    .order_by(Question.id)
+                    .limit(batch_size)
+                ).scalars().all()
+                if not batch:
+                    break
+                for question in batch:
+                    file.write(json.dumps(question.format()) + '\n')
+                exported += len(batch)
+                last_id = batch[-1].id
+                context.progress(exported, total)
+        os.replace(temporary, path)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    return {'questions': exported}
+
+
+JOB_KINDS = {
+    'reseed': reseed,
+    'reindex': reindex,
+    'reconcile': reconcile,
+    'export': export,
+}
+
+"""
+JOB_PARAMS
+    the params each kind accepts, as {name: (minimum, maximum)} for
+    integer params, checked by valid_params before a job is queued
+"""
+JOB_PARAMS = {
+    'export': {'batch_size': (1, 1000)},
+}
+
+
+def valid_params(kind, params):
+    bounds = JOB_PARAMS.get(kind, {})
+    return set(params) <= set(bounds) and all(
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and bounds[name][0] <= value <= bounds[name][1]
+        for name, value in params.items()
+    )
@@ -1,4 +1,6 @@
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, Text, func
+from sqlalchemy import case, delete, insert, or_, select, update
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 import json
 
@@ -18,17 +20,46 @@ db = SQLAlchemy()
 
 """
 setup_db(app)
-    binds a flask application and a SQLAlchemy service
+    binds a flask application and a SQLAlchemy service,
+    creating any missing tables unless create_all is False
 """
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=database_path, create_all=True):
     app.config['SQLALCHEMY_DATABASE_URI'] = database_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     db.init_app(app)
-    with app.app_context():
-        db.create_all()
+    if create_all:
+        with app.app_context():
+            db.create_all()
+
+"""
+notify_question_change(op, question)
+    hands a committed question change to every listener registered on the
+    current app under app.extensions["question_listeners"].
+    op is one of "insert", "update" or "delete" and question is the
+    formatted question as it was at commit time
+"""
+def notify_question_change(op, question):
+    for listener in current_app.extensions.get('question_listeners', []):
+        listener(op, question)
+
+"""
+lock_change_feed()
+    takes the change feed's transaction-scoped advisory lock on Postgres,
+    so that question_changes versions are drawn and committed in the same
+    order and a reader never sees a version before an earlier one commits.
+    Take it after the question rows are written, just before the change
+    rows, so that no writer waits for a row lock while holding it
+"""
+CHANGE_FEED_LOCK = 0x7472697669
+
+def lock_change_feed():
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(select(func.pg_advisory_xact_lock(CHANGE_FEED_LOCK)))
 
 """
 Question
+    version is bumped on every update and is used for optimistic
+    concurrency checks, both by the ORM and by bulk_update/bulk_delete
 """
 class Question(db.Model):
     __tablename__ = 'questions'
@@ -38,6 +69,9 @@ class Question(db.Model):
     answer = Column(String, nullable=False)
     category = Column(Integer, nullable=False)
     difficulty = Column(Integer, nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -47,14 +81,122 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        lock_change_feed()
+        db.session.add(QuestionChange('insert', self))
         db.session.commit()
+        notify_question_change('insert', self.format())
 
     def update(self):
+        db.session.flush()
+        lock_change_feed()
+        db.session.add(QuestionChange('update', self))
         db.session.commit()
+        notify_question_change('update', self.format())
 
     def delete(self):
+        question = self.format()
+        change = QuestionChange('delete', self)
         db.session.delete(self)
+        db.session.flush()
+        lock_change_feed()
+        db.session.add(change)
         db.session.commit()
+        notify_question_change('delete', question)
+
+    """
+    bulk_delete(items) / bulk_update(items)
+        apply a batch with a single set-based statement, record the changes
+        and commit. items are dicts with an 'id' and an optional 'version';
+        rows whose version no longer matches are left alone.
+        Both return one {'id', 'status', 'version'} result per item, where
+        status is 'deleted' / 'updated', 'conflict' or 'not_found'
+    """
+    UPDATABLE = ('question', 'answer', 'category', 'difficulty')
+
+    @classmethod
+    def _matching(cls, items):
+        return or_(*[
+            (cls.id == item['id']) & (cls.version == item['version'])
+            if item.get('version') is not None
+            else cls.id == item['id']
+            for item in items
+        ])
+
+    @classmethod
+    def _returning(cls):
+        return (cls.id, cls.question, cls.answer, cls.category, cls.difficulty, cls.version)
+
+    @classmethod
+    def _commit_bulk(cls, op, items, rows):
+        changed = {row.id: row for row in rows}
+        if rows:
+            lock_change_feed()
+            db.session.execute(insert(QuestionChange), [
+                {
+                    'op': op,
+                    'question_id': row.id,
+                    'category': row.category,
+                    'difficulty': row.difficulty
+                }
+                for row in rows
+            ])
+        missing = [item['id'] for item in items if item['id'] not in changed]
+        current = {}
+        if missing:
+            current = dict(db.session.execute(
+                select(cls.id, cls.version).where(cls.id.in_(missing))
+            ).all())
+        db.session.commit()
+        for row in rows:
+            notify_question_change(op, {
+                'id': row.id,
+                'question': row.question,
+                'answer': row.answer,
+                'category': row.category,
+                'difficulty': row.difficulty
+            })
+        results = []
+        for item in items:
+            if item['id'] in changed:
+                status = op + 'd'
+                version = changed[item['id']].version
+            elif item['id'] in current:
+                status = 'conflict'
+                version = current[item['id']]
+            else:
+                status = 'not_found'
+                version = None
+            results.append({'id': item['id'], 'status': status, 'version': version})
+        return results
+
+    @classmethod
+    def bulk_delete(cls, items):
+        rows = db.session.execute(
+            delete(cls)
+            .where(cls._matching(items))
+            .returning(*cls._returning())
+            .execution_options(synchronize_session=False)
+        ).all()
+        return cls._commit_bulk('delete', items, rows)
+
+    @classmethod
+    def bulk_update(cls, items):
+        values = {'version': cls.version + 1}
+        for field in cls.UPDATABLE:
+            new_values = {item['id']: item[field] for item in items if field in item}
+            if new_values:
+                values[field] = case(
+                    new_values, value=cls.id, else_=getattr(cls, field)
+                )
+        rows = db.session.execute(
+            update(cls)
+            .where(cls._matching(items))
+            .values(values)
+            .returning(*cls._returning())
+            .execution_options(synchronize_session=False)
+        ).all()
+        return cls._commit_bulk('update', items, rows)
 
     def format(self):
         return {
@@ -65,6 +207,139 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+"""
+QuestionChange
+    one row per committed Question insert, update or delete, written in the
+    same transaction under lock_change_feed(), so versions become visible in
+    order. version is the position in the change feed; category
+    and difficulty are kept so that caches can apply the change without
+    reading the question back
+"""
+class QuestionChange(db.Model):
+    __tablename__ = 'question_changes'
+
+    version = Column(Integer, primary_key=True)
+    question_id = Column(Integer, nullable=False, index=True)
+    op = Column(String, nullable=False)
+    category = Column(Integer, nullable=False)
+    difficulty = Column(Integer, nullable=False)
+    changed_at = Column(DateTime, nullable=False, server_default=func.now())
+
+    def __init__(self, op, question):
+        self.op = op
+        self.question_id = question.id
+        self.category = question.category
+        self.difficulty = question.difficulty
+
+    def format(self):
+        return {
+            'version': self.version,
+            'question_id': self.question_id,
+            'op': self.op,
+            'changed_at': self.changed_at.isoformat() if self.changed_at else None
+        }
+
+"""
+question_watermark()
+    (latest change feed version, question count), read in one round trip.
+    A cache that saw the same pair is current; when only the version moved
+    it can catch up with question_changes(), and when the count disagrees
+    after that, rows were written without going through the Question model
+    and it has to reload
+"""
+def question_watermark():
+    return tuple(db.session.execute(select(
+        select(func.coalesce(func.max(QuestionChange.version), 0)).scalar_subquery(),
+        select(func.count(Question.id)).scalar_subquery(),
+    )).one())
+
+"""
+question_changes(after, upto)
+    the changes with a version in (after, upto], reduced to the latest one
+    per question, as {question_id: (op, category, difficulty)} in the
+    order the questions first changed
+"""
+def question_changes(after, upto):
+    changes = {}
+    for question_id, op, category, difficulty in db.session.execute(
+        select(
+            QuestionChange.question_id,
+            QuestionChange.op,
+            QuestionChange.category,
+            QuestionChange.difficulty,
+        )
+        .where(QuestionChange.version > after)
+        .where(QuestionChange.version <= upto)
+        .order_by(QuestionChange.version)
+    ):
+        changes[question_id] = (op, category, difficulty)
+    return changes
+
+"""
+QuizAnswer
+    one answered quiz question. Rows are written in batches by AnswerBuffer
+    rather than one at a time
+"""
+class QuizAnswer(db.Model):
+    __tablename__ = 'quiz_answers'
+
+    id = Column(Integer, primary_key=True)
+    player = Column(String, nullable=False, index=True)
+    question_id = Column(Integer, nullable=False)
+    category = Column(Integer, nullable=True)
+    correct = Column(Boolean, nullable=False)
+    answered_at = Column(DateTime, nullable=False, server_default=func.now())
+
+"""
+Job
+    a maintenance job run off the request path by JobRunner.
+    result holds the job's JSON-encoded return value
+"""
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False)
+    params = Column(Text, nullable=False, default='{}')
+    status = Column(String, nullable=False, default='queued')
+    progress = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=True)
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    result = Column(Text, nullable=True)
+    error = Column(String, nullable=True)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    def __init__(self, kind, params):
+        self.kind = kind
+        self.params = json.dumps(params)
+        self.status = 'queued'
+        self.progress = 0
+        self.cancel_requested = False
+
+    def insert(self):
+        db.session.add(self)
+        db.session.commit()
+
+    def update(self):
+        db.session.commit()
+
+    def format(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': json.loads(self.params),
+            'status': self.status,
+            'progress': self.progress,
+            'total': self.total,
+            'result': json.loads(self.result) if self.result is not None else None,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
 """
 Category
 """
@@ -0,0 +1,257 @@
+from array import array
+import threading
+import time
+import zlib
+
+from sqlalchemy import select
+
+from models import db, Question, Category, question_changes, question_watermark
+
+"""
+QuestionIndex
+    a worker-local snapshot of the (id, category, difficulty) columns of the
+    questions table, held in compact typed arrays.
+
+    Quiz selection, per-category counts and difficulty filtering are answered
+    from the snapshot; the database is only needed to fetch the text of the
+    chosen question. The snapshot checks a (change feed version, question
+    count, category ids checksum) watermark at most once per
+    refresh_interval seconds and applies only the question_changes rows
+    recorded since the last check, falling back to a full reload when the
+    counts disagree (e.g. rows written without going through the Question
+    model). Reloads build new arrays and swap them in under the lock.
+    Writes made through Question.insert/update/delete in this worker are
+    applied immediately through apply().
+
+    When pools (a QuestionPools) is given, the snapshot is published once into
+    a shared segment instead of being held by every worker: reads go to the
+    shared segment, and the local arrays are only filled while a worker that
+    saw a newer watermark rebuilds and republishes it.
+"""
+class QuestionIndex:
+    def __init__(self, refresh_interval=1.0, pools=None):
+        self.refresh_interval = refresh_interval
+        self.pools = pools
+        self._lock = threading.RLock()
+        self._ids = array('l')
+        self._categories = array('l')
+        self._difficulties = array('l')
+        self._positions = {}
+        self._category_ids = set()
+        self._watermark = None
+        self._checked_at = 0.0
+
+    def __len__(self):
+        return self.count()
+
+    def _read_watermark(self):
+        """The current watermark and category ids"""
+        version, count = question_watermark()
+        category_ids = set(db.session.execute(select(Category.id)).scalars())
+        checksum = zlib.crc32(','.join(map(str, sorted(category_ids))).encode())
+        return (version, count, checksum), category_ids
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if (
+            not force
+            and self._watermark is not None
+            and now - self._checked_at < self.refresh_interval
+        ):
+            return
+        with self._lock:
+            watermark, category_ids = self._read_watermark()
+            self._checked_at = now
+            if self.pools is not None:
+                self._refresh_shared(watermark, category_ids)
+            else:
+                self._refresh_local(watermark, category_ids)
+
+    def rebuild(self):
+        """Discard the snapshot and reload it from the questions table"""
+        with self._lock:
+            watermark, category_ids = self._read_watermark()
+            self._category_ids = category_ids
+            self._load_questions()
+            self._watermark = watermark
+            self._checked_at = time.monotonic()
+            count = len(self._ids)
+            if self.pools is not None:
+                self._publish()
+            return count
+
+    def _refresh_local(self, watermark, category_ids):
+        version, count, category_checksum = watermark
+        if watermark == self._watermark:
+            return
+        if self._watermark is None or self._watermark[2] != category_checksum:
+            self._category_ids = category_ids
+        if self._watermark is not None:
+            changes = question_changes(self._watermark[0], version)
+            for question_id, (op, category, difficulty) in changes.items():
+                if op == 'delete':
+                    self._remove(question_id)
+                else:
+                    self._append(question_id, category, difficulty)
+            if len(self._ids) == count:
+                self._watermark = watermark
+                return
+        self._load_questions()
+        self._watermark = watermark
+
+    def _refresh_shared(self, watermark, category_ids):
+        snapshot = self.pools.current()
+        if snapshot is not None and snapshot.watermark == watermark:
+            self._watermark = watermark
+            return
+        self._checkout(snapshot)
+        self._refresh_local(watermark, category_ids)
+        self._publish()
+
+    def _checkout(self, snapshot):
+        """Copy the shared snapshot into the local arrays before changing it"""
+        self._reset()
+        self._category_ids = set()
+        self._watermark = None
+        if snapshot is None:
+            return
+        for category, rows in snapshot.pools().items():
+            self._category_ids.add(category)
+            for question_id, difficulty in rows:
+                self._append(question_id, category, difficulty)
+        self._watermark = snapshot.watermark
+
+    def _publish(self):
+        pools = {category_id: [] for category_id in self._category_ids}
+        for question_id, category, difficulty in zip(
+            self._ids, self._categories, self._difficulties
+        ):
+            pools.setdefault(category, []).append((question_id, difficulty))
+        self.pools.publish(self._watermark, pools)
+        self._reset()
+
+    def _reset(self):
+        self._ids = array('l')
+        self._categories = array('l')
+        self._difficulties = array('l')
+        self._positions = {}
+
+    def _load_questions(self):
+        ids = array('l')
+        categories = array('l')
+        difficulties = array('l')
+        positions = {}
+        rows = db.session.execute(
+            select(Question.id, Question.category, Question.difficulty).order_by(
+                Question.id
+            )
+        )
+        for question_id, category, difficulty in rows:
+            positions[question_id] = len(ids)
+            ids.append(question_id)
+            categories.append(category)
+            difficulties.append(difficulty)
+        self._ids = ids
+        self._categories = categories
+        self._difficulties = difficulties
+        self._positions = positions
+
+    def _append(self, question_id, category, difficulty):
+        if question_id in self._positions:
+            position = self._positions[question_id]
+            self._categories[position] = category
+            self._difficulties[position] = difficulty
+            return
+        self._positions[question_id] = len(self._ids)
+        self._ids.append(question_id)
+        self._categories.append(category)
+        self._difficulties.append(difficulty)
+
+    def _remove(self, question_id):
+        position = self._positions.pop(question_id, None)
+        if position is None:
+            return
+        # swap the last entry into the freed slot so removal stays O(1)
+        last = len(self._ids) - 1
+        if position != last:
+            moved = self._ids[last]
+            self._ids[position] = moved
+            self._categories[position] = self._categories[last]
+            self._difficulties[position] = self._difficulties[last]
+            self._positions[moved] = position
+        del self._ids[last]
+        del self._categories[last]
+        del self._difficulties[last]
+
+    def apply(self, op, question):
+        """Listener for notify_question_change"""
+        with self._lock:
+            if self._watermark is None:
+                return
+            if self.pools is not None:
+                self._checkout(self.pools.current())
+                if self._watermark is None:
+                    return
+            if op == 'delete':
+                self._remove(question['id'])
+            else:
+                self._append(question['id'], question['category'], question['difficulty'])
+            # the change row itself is picked up, idempotently, on the next refresh
+            version, count, category_checksum = self._watermark
+            self._watermark = (version, len(self._ids), category_checksum)
+            if self.pools is not None:
+                self._publish()
+
+    def _shared(self):
+        self.refresh()
+        if self.pools is None:
+            return None
+        return self.pools.current()
+
+    def has_category(self, category_id):
+        snapshot = self._shared()
+        if snapshot is not None:
+            return snapshot.has_category(category_id)
+        with self._lock:
+            return category_id in self._category_ids
+
+    def select(self, category=None, difficulty=None, exclude=()):
+        """Ids matching category and difficulty (None matches all), minus exclude"""
+        snapshot = self._shared()
+        excluded = set(exclude)
+        if snapshot is not None:
+            return [
+                question_id
+                for question_id, question_difficulty in snapshot.rows(category)
+                if (difficulty is None or question_difficulty == difficulty)
+                and question_id not in excluded
+            ]
+        with self._lock:
+            return [
+                question_id
+                for question_id, question_category, question_difficulty in zip(
+                    self._ids, self._categories, self._difficulties
+                )
+                if (category is None or question_category == category)
+                and (difficulty is None or question_difficulty == difficulty)
+                and question_id not in excluded
+            ]
+
+    def count(self, category=None):
+        snapshot = self._shared()
+        if snapshot is not None:
+            return snapshot.count(category)
+        with self._lock:
+            if category is None:
+                return len(self._ids)
+            return self._categories.count(category)
+
+    def counts_by_category(self):
+        snapshot = self._shared()
+        if snapshot is not None:
+            return snapshot.counts()
+        with self._lock:
+            counts = {category_id: 0 for category_id in self._category_ids}
+            for category in self._categories:
+                counts[category] = counts.get(category, 0) + 1
+            return counts
@@ -0,0 +1,365 @@
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+"""
+Segment layout (native byte order, standard sizes):
+    header      version, watermark (3 x int64), number of categories
+    table       one (category, offset, count) entry per category
+    ids         int64 question ids grouped by category
+    difficulty  int32 difficulty for each id, in the same order
+"""
+_HEADER = struct.Struct('=Q3qQ')
+_ENTRY = struct.Struct('=qQQ')
+_POINTER = struct.Struct('=Q')
+
+
+def _segment_size(category_count, question_count):
+    return (
+        _HEADER.size
+        + _ENTRY.size * category_count
+        + 8 * question_count
+        + 4 * question_count
+    )
+
+
+def _encode(buffer, version, watermark, pools):
+    categories = sorted(pools)
+    question_count = sum(len(pools[category]) for category in categories)
+    _HEADER.pack_into(buffer, 0, version, *watermark, len(categories))
+    ids_start = _HEADER.size + _ENTRY.size * len(categories)
+    difficulties_start = ids_start + 8 * question_count
+    ids = memoryview(buffer)[ids_start:difficulties_start].cast('q')
+    difficulties = memoryview(buffer)[
+        difficulties_start:difficulties_start + 4 * question_count
+    ].cast('i')
+    offset = 0
+    for position, category in enumerate(categories):
+        rows = pools[category]
+        _ENTRY.pack_into(
+            buffer, _HEADER.size + _ENTRY.size * position, category, offset, len(rows)
+        )
+        for question_id, difficulty in rows:
+            ids[offset] = question_id
+            difficulties[offset] = difficulty
+            offset += 1
+    ids.release()
+    difficulties.release()
+
+
+"""
+PoolSnapshot
+    a read-only, zero-copy view over one published segment. rows() and
+    ids() hand out their own slices of it, so close() can release the
+    snapshot's views without breaking a reader still iterating one; the
+    segment itself cannot be unmapped until those slices are gone, and
+    close() raises BufferError until then
+"""
+class PoolSnapshot:
+    def __init__(self, buffer, handle, close):
+        self.version, *watermark, category_count = _HEADER.unpack_from(buffer, 0)
+        self.watermark = tuple(watermark)
+        self._table = {}
+        question_count = 0
+        for position in range(category_count):
+            category, offset, count = _ENTRY.unpack_from(
+                buffer, _HEADER.size + _ENTRY.size * position
+            )
+            self._table[category] = (offset, count)
+            question_count += count
+        ids_start = _HEADER.size + _ENTRY.size * category_count
+        difficulties_start = ids_start + 8 * question_count
+        self._view = memoryview(buffer)
+        self._ids = self._view[ids_start:difficulties_start].cast('q')
+        self._difficulties = self._view[
+            difficulties_start:difficulties_start + 4 * question_count
+        ].cast('i')
+        self._handle = handle
+        self._close = close
+
+    def rows(self, category=None):
+        """(id, difficulty) pairs for category, or for every question if None"""
+        if category is None:
+            return zip(self._ids[:], self._difficulties[:])
+        offset, count = self._table.get(category, (0, 0))
+        return zip(
+            self._ids[offset:offset + count],
+            self._difficulties[offset:offset + count],
+        )
+
+    def ids(self, category=None):
+        if category is None:
+            return self._ids[:]
+        offset, count = self._table.get(category, (0, 0))
+        return self._ids[offset:offset + count]
+
+    def pools(self):
+        """Copy of the segment as {category: [(id, difficulty), ...]}"""
+        return {category: list(self.rows(category)) for category in self._table}
+
+    def has_category(self, category):
+        return category in self._table
+
+    def count(self, category=None):
+        if category is None:
+            return len(self._ids)
+        return self._table.get(category, (0, 0))[1]
+
+    def counts(self):
+        return {category: count for category, (offset, count) in self._table.items()}
+
+    def close(self):
+        self._ids.release()
+        self._difficulties.release()
+        self._view.release()
+        self._close(self._handle)
+
+
+"""
+_SharedMemoryStore
+    segments live in multiprocessing.shared_memory: "<name>" holds the
+    current version and "<name>.<version>" holds each published segment.
+    Publishers serialise on the lock file "<name>.lock" in the temp directory
+"""
+class _SharedMemoryStore:
+    def __init__(self, name):
+        self.name = name
+        self.lock_path = os.path.join(tempfile.gettempdir(), f'{name}.lock')
+        try:
+            self._pointer = shared_memory.SharedMemory(
+                name=name, create=True, size=_POINTER.size
+            )
+        except FileExistsError:
+            self._pointer = shared_memory.SharedMemory(name=name)
+        self._untrack(self._pointer)
+
+    def _untrack(self, segment):
+        # segments outlive the worker that created them; keep the resource
+        # tracker from unlinking them when that worker exits
+        resource_tracker.unregister(segment._name, 'shared_memory')
+
+    def read_pointer(self):
+        return _POINTER.unpack_from(self._pointer.buf, 0)[0]
+
+    def write_pointer(self, version):
+        _POINTER.pack_into(self._pointer.buf, 0, version)
+
+    def create(self, version, size):
+        segment = shared_memory.SharedMemory(
+            name=f'{self.name}.{version}', create=True, size=max(size, 1)
+        )
+        self._untrack(segment)
+        return segment.buf, segment
+
+    def commit(self, handle):
+        handle.close()
+
+    def attach(self, version):
+        segment = shared_memory.SharedMemory(name=f'{self.name}.{version}')
+        self._untrack(segment)
+        return segment.buf, segment
+
+    def close(self, handle):
+        handle.close()
+
+    def unlink(self, version):
+        try:
+            segment = shared_memory.SharedMemory(name=f'{self.name}.{version}')
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+    def destroy(self):
+        self._pointer.close()
+        # unlink() unregisters the segment, so hand it back to the tracker first
+        resource_tracker.register(self._pointer._name, 'shared_memory')
+        self._pointer.unlink()
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+
+"""
+_MmapStore
+    the same layout kept in files under directory and read with mmap, for
+    tests and single-host deployments without /dev/shm. The pointer file
+    "current" and each segment are swapped in with os.replace, and
+    publishers serialise on the lock file "lock"
+"""
+class _MmapStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._pointer_path = os.path.join(directory, 'current')
+        self.lock_path = os.path.join(directory, 'lock')
+
+    def _path(self, version):
+        return os.path.join(self.directory, f'pools.{version}')
+
+    def read_pointer(self):
+        try:
+            with open(self._pointer_path, 'rb') as file:
+                return _POINTER.unpack(file.read(_POINTER.size))[0]
+        except (FileNotFoundError, struct.error):
+            return 0
+
+    def write_pointer(self, version):
+        temporary = f'{self._pointer_path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as file:
+            file.write(_POINTER.pack(version))
+        os.replace(temporary, self._pointer_path)
+
+    def create(self, version, size):
+        temporary = f'{self._path(version)}.tmp'
+        file = open(temporary, 'w+b')
+        file.truncate(max(size, 1))
+        buffer = mmap.mmap(file.fileno(), max(size, 1))
+        return buffer, (file, buffer, temporary, self._path(version))
+
+    def commit(self, handle):
+        file, buffer, temporary, path = handle
+        buffer.flush()
+        buffer.close()
+        file.close()
+        os.replace(temporary, path)
+
+    def attach(self, version):
+        with open(self._path(version), 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return buffer, buffer
+
+    def close(self, handle):
+        handle.close()
+
+    def unlink(self, version):
+        try:
+            os.remove(self._path(version))
+        except FileNotFoundError:
+            pass
+
+    def destroy(self):
+        for entry in os.listdir(self.directory):
+            if entry in ('current', 'lock') or entry.startswith('pools.'):
+                os.remove(os.path.join(self.directory, entry))
+
+
+"""
+QuestionPools
+    id-by-category question pools published once and shared by every worker.
+
+    publish() writes a new versioned segment and then atomically swaps the
+    current-version pointer to it; current() returns a zero-copy snapshot of
+    whatever version the pointer names, re-attaching only when it changed.
+    Publishes from every worker are serialised by an flock on the store's
+    lock file, and a snapshot is never replaced by one with an older
+    change feed version.
+    Pass directory to use file-backed mmap segments instead of
+    multiprocessing.shared_memory.
+"""
+class QuestionPools:
+    def __init__(self, name='trivia_question_pools', directory=None):
+        if directory is None:
+            self._store = _SharedMemoryStore(name)
+        else:
+            self._store = _MmapStore(directory)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._retired = []
+
+    @contextmanager
+    def _publishing(self):
+        with self._lock, open(self._store.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _watermark(self, version):
+        try:
+            buffer, handle = self._store.attach(version)
+        except FileNotFoundError:
+            return None
+        try:
+            return tuple(_HEADER.unpack_from(buffer, 0)[1:4])
+        finally:
+            self._store.close(handle)
+
+    def publish(self, watermark, pools):
+        """
+        Publish pools and return their version, or return the current version
+        unchanged if it already holds a newer change feed version
+        """
+        size = _segment_size(len(pools), sum(len(rows) for rows in pools.values()))
+        with self._publishing():
+            previous = self._store.read_pointer()
+            if previous:
+                current = self._watermark(previous)
+                if current is not None and current[0] > watermark[0]:
+                    return previous
+            version = max(time.time_ns(), previous + 1)
+            buffer, handle = self._store.create(version, size)
+            _encode(buffer, version, watermark, pools)
+            self._store.commit(handle)
+            self._store.write_pointer(version)
+            if previous:
+                self._store.unlink(previous)
+        return version
+
+    def current(self):
+        while True:
+            version = self._store.read_pointer()
+            if version == 0:
+                return None
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.version == version:
+                return snapshot
+            with self._lock:
+                if self._snapshot is not None and self._snapshot.version == version:
+                    return self._snapshot
+                try:
+                    buffer, handle = self._store.attach(version)
+                except FileNotFoundError:
+                    # replaced between reading the pointer and attaching: the
+                    # pointer already names the newer segment
+                    if self._store.read_pointer() != version:
+                        continue
+                    return self._snapshot
+                # close snapshots two versions old; readers of the previous
+                # one may still be iterating it
+                self._retired = self._close_snapshots(self._retired)
+                if self._snapshot is not None:
+                    self._retired.append(self._snapshot)
+                self._snapshot = PoolSnapshot(buffer, handle, self._store.close)
+                return self._snapshot
+
+    def _close_snapshots(self, snapshots):
+        """Close snapshots and return those a reader still holds a slice of"""
+        still_open = []
+        for snapshot in snapshots:
+            try:
+                snapshot.close()
+            except BufferError:
+                still_open.append(snapshot)
+        return still_open
+
+    def close(self, unlink=False):
+        with self._lock:
+            snapshots = self._retired
+            if self._snapshot is not None:
+                snapshots = snapshots + [self._snapshot]
+            self._retired = self._close_snapshots(snapshots)
+            self._snapshot = None
+            if unlink:
+                version = self._store.read_pointer()
+                if version:
+                    self._store.unlink(version)
+                self._store.destroy()
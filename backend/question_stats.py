@@ -0,0 +1,78 @@
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from models import db, Question, question_watermark
+
+"""
+QuestionStats
+    question counts by category, difficulty and question text length, from
+    one GROUP BY over the questions table.
+
+    The grouped rows are cached and dropped by invalidate() whenever this
+    worker writes a question; writes made by other workers are noticed
+    through a (change feed version, question count) watermark checked at
+    most once per refresh_interval seconds. Every rollup, including the
+    length histogram for any bucket size, is computed from the cached rows.
+"""
+class QuestionStats:
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._rows = None
+        self._watermark = None
+        self._checked_at = 0.0
+
+    def rows(self):
+        """(category, difficulty, length, count) for every group"""
+        now = time.monotonic()
+        with self._lock:
+            if self._rows is not None and now - self._checked_at < self.refresh_interval:
+                return self._rows
+            watermark = question_watermark()
+            self._checked_at = now
+            if self._rows is not None and watermark == self._watermark:
+                return self._rows
+            length = func.length(Question.question)
+            self._rows = [
+                tuple(row)
+                for row in db.session.execute(
+                    select(
+                        Question.category,
+                        Question.difficulty,
+                        length,
+                        func.count(Question.id),
+                    ).group_by(Question.category, Question.difficulty, length)
+                )
+            ]
+            self._watermark = watermark
+            return self._rows
+
+    def invalidate(self, op=None, question=None):
+        """Listener for notify_question_change"""
+        with self._lock:
+            self._rows = None
+
+    def summary(self, bucket):
+        """
+        Counts by category and difficulty, and a histogram of question
+        length in buckets of bucket characters
+        """
+        counts = {}
+        histogram = {}
+        for category, difficulty, length, count in self.rows():
+            key = (category, difficulty)
+            counts[key] = counts.get(key, 0) + count
+            start = (length or 0) // bucket * bucket
+            histogram[start] = histogram.get(start, 0) + count
+        return {
+            'counts': [
+                {'category': category, 'difficulty': difficulty, 'count': count}
+                for (category, difficulty), count in sorted(counts.items())
+            ],
+            'length_histogram': [
+                {'from': start, 'to': start + bucket - 1, 'count': histogram[start]}
+                for start in sorted(histogram)
+            ],
+        }
@@ -0,0 +1,239 @@
+from collections import OrderedDict
+from functools import wraps
+import logging
+import math
+import threading
+import time
+
+from flask import abort, has_request_context, make_response, request
+from sqlalchemy import event, exc
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+"""
+Errors that mean the database is slow or unreachable, as opposed to a bad
+request: timeouts (a cancelled statement surfaces as OperationalError),
+dropped connections and an exhausted connection pool
+"""
+DATABASE_UNAVAILABLE = (exc.OperationalError, exc.InterfaceError, exc.TimeoutError)
+
+
+"""
+CircuitBreaker
+    opens after failure_threshold consecutive database failures; while open,
+    requests are refused without touching the database. After reset_timeout
+    seconds a single probe request is let through (half-open); its outcome
+    closes the breaker or re-opens it for another reset_timeout
+"""
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if self._probing or time.monotonic() >= self._opened_at + self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing:
+                return False
+            if time.monotonic() >= self._opened_at + self.reset_timeout:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def retry_after(self):
+        """Whole seconds until the next probe is allowed"""
+        if self._opened_at is None:
+            return 0
+        remaining = self._opened_at + self.reset_timeout - time.monotonic()
+        return max(1, math.ceil(remaining))
+
+
+"""
+ResponseCache
+    the last good response for each read URL, bounded to max_entries
+    (least recently stored first out)
+"""
+class ResponseCache:
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def store(self, key, response):
+        entry = (
+            response.get_data(),
+            response.status_code,
+            [
+                (name, value)
+                for name, value in response.headers.items()
+                if name.lower() not in ('content-length', 'date')
+            ],
+            time.time(),
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stale(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        data, status, headers, stored_at = entry
+        response = make_response(data, status, headers)
+        response.headers['Age'] = str(int(time.time() - stored_at))
+        response.headers['Warning'] = '110 - "Response is Stale"'
+        response.headers['X-Cache'] = 'STALE'
+        return response
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+"""
+Resilience
+    wraps views that touch the database. install() gives every connection
+    checked out of the pool the statement timeout of the endpoint checking
+    it out (Postgres only); it is set at session level, only when it differs
+    from the connection's current one, so it survives commits and usually
+    costs no round-trip. guard() trips the circuit breaker on database
+    failures and, while the database is failing:
+    - GET views guarded with stale=True serve their last good response,
+      marked stale, and refresh it in the background once a probe is allowed
+    - every other request fails fast with 503 and Retry-After
+"""
+class Resilience:
+    def __init__(self, app, breaker, cache, timeout_ms=2000, endpoint_timeouts_ms=None):
+        self.app = app
+        self.breaker = breaker
+        self.cache = cache
+        self.timeout_ms = timeout_ms
+        self.endpoint_timeouts_ms = endpoint_timeouts_ms or {}
+        self._revalidating = set()
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        if engine.dialect.name == 'postgresql':
+            event.listen(engine, 'checkout', self._apply_timeout)
+
+    def _apply_timeout(self, dbapi_connection, connection_record, connection_proxy):
+        endpoint = request.endpoint if has_request_context() else None
+        timeout_ms = int(self.endpoint_timeouts_ms.get(endpoint, self.timeout_ms))
+        if connection_record.info.get('statement_timeout') == timeout_ms:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'SET statement_timeout = {timeout_ms}')
+        finally:
+            cursor.close()
+        # nothing else is in this transaction yet; commit so that the
+        # setting is not undone by a later rollback
+        dbapi_connection.commit()
+        connection_record.info['statement_timeout'] = timeout_ms
+
+    def _unavailable(self):
+        abort(503, retry_after=self.breaker.retry_after() or 1)
+
+    def guard(self, stale=False):
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                cacheable = stale and request.method == 'GET'
+                key = request.full_path
+                if not self.breaker.allow():
+                    return self._fallback(cacheable, key, view, args, kwargs)
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except DATABASE_UNAVAILABLE:
+                    logger.warning('database unavailable for %s', key, exc_info=True)
+                    db.session.rollback()
+                    self.breaker.record_failure()
+                    return self._fallback(cacheable, key, view, args, kwargs)
+                except Exception:
+                    # the database answered; the failure is the request's
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_success()
+                if cacheable and response.status_code == 200:
+                    self.cache.store(key, response)
+                return response
+            return wrapper
+        return decorator
+
+    def _fallback(self, cacheable, key, view, args, kwargs):
+        if cacheable:
+            response = self.cache.stale(key)
+            if response is not None:
+                self._revalidate(key, view, args, kwargs)
+                return response
+        self._unavailable()
+
+    def _revalidate(self, key, view, args, kwargs):
+        with self._lock:
+            if key in self._revalidating:
+                return
+            self._revalidating.add(key)
+        thread = threading.Thread(
+            target=self._run_revalidate,
+            args=(key, view, args, kwargs),
+            name='revalidate',
+            daemon=True,
+        )
+        thread.start()
+
+    def _run_revalidate(self, key, view, args, kwargs):
+        try:
+            time.sleep(self.breaker.retry_after())
+            with self.app.test_request_context(key):
+                if not self.breaker.allow():
+                    return
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except DATABASE_UNAVAILABLE:
+                    db.session.rollback()
+                    self.breaker.record_failure()
+                    return
+                except Exception:
+                    self.breaker.record_success()
+                    return
+                finally:
+                    db.session.remove()
+                self.breaker.record_success()
+                if response.status_code == 200:
+                    self.cache.store(key, response)
+        except Exception:
+            logger.exception('revalidating %s failed', key)
+        finally:
+            with self._lock:
+                self._revalidating.discard(key)
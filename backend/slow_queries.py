@@ -0,0 +1,119 @@
+from collections import deque
+from datetime import datetime, timezone
+import json
+import logging
+import random
+import threading
+import time
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+"""
+SlowQueryLog
+    records every statement that takes at least threshold_ms on the engine
+    it is installed on: the SQL, its parameters (None when
+    redact_parameters is set), the endpoint that issued it and, for a
+    sampled explain_rate fraction of slow SELECTs on Postgres, the
+    EXPLAIN (ANALYZE, BUFFERS) plan.
+
+    The newest max_entries records are kept in memory for the admin
+    endpoint; with log_path set, every record is also appended to that file
+    as one JSON object per line. EXPLAIN ANALYZE runs the statement a second
+    time, which is why plans are sampled.
+"""
+class SlowQueryLog:
+    def __init__(
+        self, threshold_ms=200, explain_rate=0.1, max_entries=100, log_path=None,
+        redact_parameters=True,
+    ):
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self.redact_parameters = redact_parameters
+        self.log_path = log_path
+        self._entries = deque(maxlen=max_entries)
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before)
+        event.listen(engine, 'after_cursor_execute', self._after)
+
+    # the start time lives on the execution context, which is discarded
+    # with the statement whether or not it succeeds
+    def _before(self, connection, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_started_at = time.perf_counter()
+
+    def _after(self, connection, cursor, statement, parameters, context, executemany):
+        started = getattr(context, 'slow_query_started_at', None)
+        if started is None:
+            return
+        duration_ms = (time.perf_counter() - started) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        entry = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'duration_ms': round(duration_ms, 3),
+            'sql': statement,
+            'parameters': self._parameters(parameters, executemany),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'plan': None,
+        }
+        if (
+            connection.dialect.name == 'postgresql'
+            and not executemany
+            and statement.lstrip().upper().startswith('SELECT')
+            and random.random() < self.explain_rate
+        ):
+            entry['plan'] = self._explain(connection, statement, parameters)
+        self.record(entry)
+
+    def _parameters(self, parameters, executemany):
+        if self.redact_parameters:
+            return None
+        if executemany:
+            parameters = list(parameters[:5])
+        return json.loads(json.dumps(parameters, default=repr))
+
+    def _explain(self, connection, statement, parameters):
+        # a separate DBAPI cursor: the original one still holds unread rows,
+        # and bypassing the engine keeps this statement out of the log. The
+        # savepoint keeps a failed EXPLAIN from aborting the transaction
+        cursor = connection.connection.cursor()
+        try:
+            cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(
+                    'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + statement, parameters
+                )
+                plan = cursor.fetchone()[0]
+            except Exception as error:
+                logger.warning('EXPLAIN of slow query failed: %s', error)
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+                return None
+            cursor.execute('RELEASE SAVEPOINT slow_query_explain')
+            return plan
+        except Exception as error:
+            logger.warning('EXPLAIN of slow query failed: %s', error)
+            return None
+        finally:
+            cursor.close()
+
+    def record(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+            if self.log_path is not None:
+                with open(self.log_path, 'a') as file:
+                    file.write(json.dumps(entry, default=repr) + '\n')
+
+    def entries(self, limit=None):
+        """Newest first"""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit is not None else entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,37 @@
+from sqlalchemy import bindparam, select
+
+from models import Question, Category
+
+"""
+Prebuilt statements for the hot read paths.
+
+Building a Query on every request means constructing the statement and
+generating its cache key before SQLAlchemy can even look up the compiled
+SQL. These are built once at import time with bound parameters for the
+per-request values, so each request only binds parameters and the compiled
+form comes straight out of the engine's compiled cache.
+"""
+categories_by_type = select(Category).order_by(Category.type)
+
+category_by_id = select(Category).where(Category.id == bindparam('category_id'))
+
+questions_page = (
+    select(Question)
+    .order_by(Question.id)
+    .limit(bindparam('limit'))
+    .offset(bindparam('offset'))
+)
+
+questions_by_category = (
+    select(Question)
+    .where(Question.category == bindparam('category_id'))
+    .order_by(Question.id)
+)
+
+questions_matching = (
+    select(Question)
+    .where(Question.question.ilike(bindparam('pattern')))
+    .order_by(Question.id)
+)
+
+question_by_id = select(Question).where(Question.id == bindparam('question_id'))
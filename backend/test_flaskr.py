@@ -1,12 +1,17 @@
 import os
+import tempfile
+import threading
+import time
 import unittest
+from unittest import mock
 
 import json
 
-from sqlalchemy import text, create_engine
+from sqlalchemy import exc, text, create_engine
 
-from flaskr import create_app
-from models import db, Question, Category
+from flaskr import create_app, warm_app, post_fork
+from models import db, Question, Category, CHANGE_FEED_LOCK
+from question_pools import QuestionPools
 from seed_test_db import make_categories, make_questions
 
 import json
@@ -42,6 +47,9 @@ class TriviaTestCase(unittest.TestCase):
 
         # Clean out the db if anything is already there
         with self.engine.connect() as connection:
+            connection.execute(text("DROP TABLE IF EXISTS question_changes;"))
+            connection.execute(text("DROP TABLE IF EXISTS quiz_answers;"))
+            connection.execute(text("DROP TABLE IF EXISTS jobs;"))
             connection.execute(text("DROP TABLE IF EXISTS questions;"))
             connection.execute(text("DROP TABLE IF EXISTS categories;"))
             connection.close()
@@ -55,6 +63,7 @@ class TriviaTestCase(unittest.TestCase):
 
     def tearDown(self):
         """Executed after each test"""
+        self.app.extensions["job_runner"].shutdown()
         with self.engine.connect() as connection:
             connection.execute(text("DROP TABLE questions;"))
             connection.execute(text("DROP TABLE categories;"))
@@ -122,6 +131,39 @@ class TriviaTestCase(unittest.TestCase):
             },
         )
 
+    def test_get_questions_include(self):
+        res = self.client.get("/questions?page=2&include=total_questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(data.keys()), ["questions", "success", "total_questions"])
+        self.assertEqual(data["total_questions"], 19)
+        self.assertEqual(
+            res.headers["X-Categories-Version"],
+            self.client.get("/categories").headers["X-Categories-Version"],
+        )
+
+    def test_categories_version_changes_on_rename(self):
+        self.app.extensions["category_cache"].refresh_interval = 0
+        before = self.client.get("/questions?page=2")
+        with self.engine.begin() as connection:
+            connection.execute(text("UPDATE categories SET type = 'Landmarks' WHERE id = 3"))
+        res = self.client.get("/questions?page=2")
+        data = json.loads(res.data)
+
+        self.assertNotEqual(
+            res.headers["X-Categories-Version"], before.headers["X-Categories-Version"]
+        )
+        self.assertIn({"id": 3, "type": "Landmarks"}, data["categories"])
+
+    def test_get_questions_include_nothing(self):
+        res = self.client.get("/questions?include=")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(list(data.keys()), ["questions", "success"])
+        self.assertEqual(len(data["questions"]), 10)
+
     def test_get_questions_404(self):
         res = self.client.get("/questions?page=200")
         data = json.loads(res.data)
@@ -129,6 +171,13 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 404)
         self.assertDictEqual(data, {"error": "Not Found", "success": False})
 
+    def test_get_questions_page_zero_404(self):
+        res = self.client.get("/questions?page=0")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertDictEqual(data, {"error": "Not Found", "success": False})
+
     def test_get_questions_bad_query_param_type_200(self):
         # ignore improper query params and return a default of 1 for page
         res = self.client.get("/questions?page=sizzle")
@@ -156,6 +205,38 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data["success"], False)
         self.assertEqual(data["error"], "Not Found")
 
+    def test_get_question_changes(self):
+        self.client.delete("/questions/2")
+        self.client.post(
+            "/questions",
+            json={"answer": "Agra", "category": 3, "difficulty": 2, "question": "Where?"},
+        )
+        res = self.client.get("/questions/changes?since=0&limit=1")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["has_more"])
+        self.assertEqual(len(data["changes"]), 1)
+        self.assertEqual(data["changes"][0]["op"], "delete")
+        self.assertEqual(data["changes"][0]["question_id"], 2)
+        self.assertIsNone(data["changes"][0]["question"])
+
+        res = self.client.get(f"/questions/changes?since={data['version']}")
+        data = json.loads(res.data)
+
+        self.assertFalse(data["has_more"])
+        self.assertEqual([change["op"] for change in data["changes"]], ["insert"])
+        self.assertEqual(data["changes"][0]["question"]["answer"], "Agra")
+
+    def test_get_question_changes_up_to_date(self):
+        res = self.client.get("/questions/changes?since=0")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data, {"success": True, "changes": [], "version": 0, "has_more": False}
+        )
+
     def test_create_question(self):
         new_question = {
             "answer": "Lake Superior",
@@ -218,7 +299,7 @@ class TriviaTestCase(unittest.TestCase):
             "question": "What is the largest freshwater lake in the world by surface area?",
         }
 
-        res = self.client.patch("/questions", json=new_question)
+        res = self.client.put("/questions", json=new_question)
         data = json.loads(res.data)
 
         self.assertEqual(res.status_code, 405)
@@ -233,6 +314,69 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertEqual(data["error"], "Unsupported Media Type")
 
+    def test_bulk_delete_questions(self):
+        payload = {
+            "questions": [
+                {"id": 2},
+                {"id": 4, "version": 1},
+                {"id": 5, "version": 7},
+                {"id": 999},
+            ]
+        }
+        res = self.client.delete("/questions", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(result["id"], result["status"]) for result in data["results"]],
+            [(2, "deleted"), (4, "deleted"), (5, "conflict"), (999, "not_found")],
+        )
+        self.assertEqual(data["results"][2]["version"], 1)
+        res = self.client.get("/questions")
+        self.assertEqual(json.loads(res.data)["total_questions"], 17)
+
+    def test_bulk_update_questions(self):
+        payload = {
+            "questions": [
+                {"id": 6, "version": 1, "difficulty": 1},
+                {"id": 9, "category": 6, "answer": "Cassius Clay"},
+                {"id": 10, "version": 3, "difficulty": 2},
+            ]
+        }
+        res = self.client.patch("/questions", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data["results"],
+            [
+                {"id": 6, "status": "updated", "version": 2},
+                {"id": 9, "status": "updated", "version": 2},
+                {"id": 10, "status": "conflict", "version": 1},
+            ],
+        )
+        res = self.client.get("/categories/6/questions")
+        questions = json.loads(res.data)["questions"]
+        self.assertEqual(questions[0]["answer"], "Cassius Clay")
+
+        res = self.client.patch("/questions", json={"questions": [{"id": 6, "version": 1, "difficulty": 5}]})
+        self.assertEqual(json.loads(res.data)["results"][0]["status"], "conflict")
+
+    def test_bulk_update_questions_400(self):
+        for payload in [
+            {"questions": []},
+            {"questions": [{"id": 6}]},
+            {"questions": [{"id": 6, "category": 399}]},
+            {"questions": [{"id": 6, "difficulty": "hard"}]},
+            {"questions": [{"id": 6, "difficulty": 1}, {"id": 6, "difficulty": 2}]},
+            {"questions": [{"id": True, "difficulty": 1}]},
+            {"questions": [{"id": 6, "version": False, "difficulty": 1}]},
+            {"questions": [{"id": 6, "category": True}]},
+        ]:
+            res = self.client.patch("/questions", json=payload)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(json.loads(res.data), {"success": False, "error": "Bad Request"})
+
     def test_lookup_questions(self):
         payload = {"search_term": "title"}
         res = self.client.post("/questions/search", json=payload)
@@ -390,6 +534,51 @@ class TriviaTestCase(unittest.TestCase):
             },
         )
 
+    def test_lookup_quiz_question_by_difficulty(self):
+        payload = {"previous_questions": [], "quiz_category": 2, "difficulty": 3}
+        res = self.client.post("/quizzes", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question"]["id"], 17)
+        self.assertEqual(data["question"]["difficulty"], 3)
+
+    def test_lookup_quiz_question_no_remaining_questions(self):
+        payload = {"previous_questions": [], "quiz_category": 0, "difficulty": 5}
+        res = self.client.post("/quizzes", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data, {"success": True, "question": None})
+
+    def test_lookup_quiz_question_deleted_behind_index(self):
+        self.app.extensions["question_index"].refresh_interval = 60
+        payload = {"previous_questions": [], "quiz_category": 1}
+        self.client.post("/quizzes", json=payload)
+        with self.engine.begin() as connection:
+            connection.execute(text("DELETE FROM questions WHERE id IN (20, 21)"))
+
+        for attempt in range(5):
+            res = self.client.post("/quizzes", json=payload)
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(data["question"]["id"], 22)
+
+        with self.engine.begin() as connection:
+            connection.execute(text("DELETE FROM questions WHERE id = 22"))
+        res = self.client.post("/quizzes", json=payload)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), {"success": True, "question": None})
+
+    def test_lookup_quiz_question_bad_difficulty_400(self):
+        payload = {"previous_questions": [], "quiz_category": 1, "difficulty": "hard"}
+        res = self.client.post("/quizzes", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data["success"])
+
     def test_lookup_quiz_question_non_json_400(self):
         payload = 0b10101010
         res = self.client.post("/quizzes", data=bytes(payload), content_type='application/json')
@@ -426,6 +615,541 @@ class TriviaTestCase(unittest.TestCase):
         self.assertFalse(data["success"])
         self.assertEqual(data["error"], "Unsupported Media Type")
 
+    def test_record_quiz_answers_and_leaderboard(self):
+        answers = [
+            {"player": "ada", "question_id": 20, "correct": True, "quiz_category": 1},
+            {"player": "ada", "question_id": 21, "correct": True, "quiz_category": 1},
+            {"player": "bob", "question_id": 20, "correct": False, "quiz_category": 1},
+        ]
+        for answer in answers:
+            res = self.client.post("/quizzes/answers", json=answer)
+            self.assertEqual(res.status_code, 202)
+
+        res = self.client.get("/quizzes/leaderboard")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            [(entry["player"], entry["correct"]) for entry in data["leaderboard"]],
+            [("ada", 2), ("bob", 0)],
+        )
+        self.assertEqual(data["total_answers"], 3)
+        self.assertEqual(data["categories"], [{"id": 1, "answered": 3, "correct": 2}])
+
+        self.app.extensions["answer_buffer"].flush()
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(text("SELECT count(*) FROM quiz_answers")).scalar(), 3)
+
+    def test_record_quiz_answer_while_database_down(self):
+        answer_buffer = self.app.extensions["answer_buffer"]
+        answer_buffer.flush_size = 1
+        answer_buffer.max_pending = 2
+        payload = {"player": "ada", "question_id": 22, "correct": True}
+        with self.database_down():
+            responses = [
+                self.client.post("/quizzes/answers", json=payload) for attempt in range(3)
+            ]
+
+        self.assertEqual([res.status_code for res in responses], [202, 202, 503])
+        self.assertIn("Retry-After", responses[2].headers)
+        answer_buffer.flush()
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(text("SELECT count(*) FROM quiz_answers")).scalar(), 2)
+
+    def test_record_quiz_answer_with_category_while_database_down(self):
+        self.app.extensions["question_index"].refresh_interval = 0
+        payload = {"player": "ada", "question_id": 22, "correct": True, "quiz_category": 1}
+        with self.database_down():
+            res = self.client.post("/quizzes/answers", json=payload)
+
+        self.assertEqual(res.status_code, 202)
+        self.app.extensions["answer_buffer"].flush()
+        with self.app.app_context():
+            self.assertEqual(
+                db.session.execute(text("SELECT category FROM quiz_answers")).scalars().all(), [1]
+            )
+
+    def test_record_quiz_answer_400(self):
+        res = self.client.post("/quizzes/answers", json={"question_id": 20, "correct": "yes"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(data["success"])
+
+    def test_record_quiz_answer_415(self):
+        res = self.client.post("/quizzes/answers", data=bytes(0b10101010), content_type='application/octet-stream')
+
+        self.assertEqual(res.status_code, 415)
+
+    def admin_headers(self):
+        self.app.config["ADMIN_TOKEN"] = "secret"
+        return {"Authorization": "Bearer secret"}
+
+    def wait_for_job(self, job_id):
+        for attempt in range(50):
+            res = self.client.get(f"/jobs/{job_id}", headers=self.admin_headers())
+            data = json.loads(res.data)
+            if data["job"]["status"] not in ("queued", "running"):
+                return data["job"]
+            time.sleep(0.1)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_submit_reseed_job(self):
+        admin = self.admin_headers()
+        self.client.delete("/questions/2")
+        res = self.client.post("/jobs", json={"kind": "reseed"}, headers=admin)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 202)
+        self.assertEqual(data["job"]["kind"], "reseed")
+        job = self.wait_for_job(data["job"]["id"])
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"], {"restored": 1})
+        self.assertEqual(job["progress"], job["total"])
+        self.assertEqual(self.client.get("/questions").status_code, 200)
+
+    def test_submit_export_job(self):
+        admin = self.admin_headers()
+        res = self.client.post(
+            "/jobs", json={"kind": "export", "params": {"batch_size": 5}}, headers=admin
+        )
+        job = self.wait_for_job(json.loads(res.data)["job"]["id"])
+
+        self.assertEqual(job["status"], "succeeded")
+        self.assertEqual(job["result"], {"questions": 19})
+        res = self.client.get(f"/jobs/{job['id']}/export", headers=admin)
+        questions = [json.loads(line) for line in res.data.decode().splitlines()]
+        res.close()
+        self.assertEqual(len(questions), 19)
+
+    def test_submit_job_400(self):
+        admin = self.admin_headers()
+        res = self.client.post(
+            "/jobs", json={"kind": "export", "params": {"pages": 5}}, headers=admin
+        )
+        self.assertEqual(res.status_code, 400)
+        for batch_size in (0, -1, 1001, "5", True):
+            res = self.client.post(
+                "/jobs",
+                json={"kind": "export", "params": {"batch_size": batch_size}},
+                headers=admin,
+            )
+            self.assertEqual(res.status_code, 400)
+        res = self.client.post("/jobs", json={"kind": "format_disk"}, headers=admin)
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_job_404(self):
+        res = self.client.get("/jobs/999", headers=self.admin_headers())
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data, {"success": False, "error": "Not Found"})
+
+    def test_cancel_finished_job_422(self):
+        admin = self.admin_headers()
+        res = self.client.post("/jobs", json={"kind": "reindex"}, headers=admin)
+        job = self.wait_for_job(json.loads(res.data)["job"]["id"])
+        res = self.client.delete(f"/jobs/{job['id']}", headers=admin)
+
+        self.assertEqual(res.status_code, 422)
+
+    def test_jobs_need_admin_token(self):
+        res = self.client.post("/jobs", json={"kind": "reindex"})
+        self.assertEqual(res.status_code, 404)
+
+        self.app.config["ADMIN_TOKEN"] = "secret"
+        res = self.client.post("/jobs", json={"kind": "reindex"})
+        self.assertEqual(res.status_code, 401)
+        for method in (self.client.get, self.client.delete):
+            res = method("/jobs/1", headers={"Authorization": "Bearer wrong"})
+            self.assertEqual(res.status_code, 401)
+        res = self.client.get("/jobs/1/export")
+        self.assertEqual(res.status_code, 401)
+
+    def database_down(self):
+        def execute(*args, **kwargs):
+            raise exc.OperationalError("SELECT 1", {}, Exception("statement timeout"))
+        return mock.patch("sqlalchemy.orm.Session.execute", execute)
+
+    def test_statement_timeout_per_endpoint(self):
+        self.app.extensions["resilience"].endpoint_timeouts_ms["get_categories"] = 1234
+        with self.app.test_request_context("/categories"):
+            self.assertEqual(db.session.execute(text("SHOW statement_timeout")).scalar(), "1234ms")
+            db.session.commit()
+            self.assertEqual(db.session.execute(text("SHOW statement_timeout")).scalar(), "1234ms")
+            db.session.remove()
+        with self.app.test_request_context("/questions"):
+            self.assertEqual(db.session.execute(text("SHOW statement_timeout")).scalar(), "2s")
+            db.session.remove()
+
+    def test_get_categories_stale_when_database_down(self):
+        fresh = self.client.get("/categories")
+        with self.database_down():
+            res = self.client.get("/categories")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["X-Cache"], "STALE")
+        self.assertIn("Warning", res.headers)
+        self.assertEqual(json.loads(res.data), json.loads(fresh.data))
+
+    def test_get_questions_503_when_database_down_and_not_cached(self):
+        with self.database_down():
+            res = self.client.get("/questions?page=2")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertIn("Retry-After", res.headers)
+        self.assertEqual(data, {"success": False, "error": "Service Unavailable"})
+
+    def test_create_question_fails_fast_when_circuit_open(self):
+        breaker = self.app.extensions["resilience"].breaker
+        for attempt in range(breaker.failure_threshold):
+            breaker.record_failure()
+        new_question = {
+            "answer": "Lake Superior",
+            "category": 3,
+            "difficulty": 3,
+            "question": "What is the largest freshwater lake in the world by surface area?",
+        }
+        res = self.client.post("/questions", json=new_question)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertGreaterEqual(int(res.headers["Retry-After"]), 1)
+
+    def test_warm_and_post_fork(self):
+        warm_app(self.app)
+        post_fork(self.app)
+        res = self.client.get("/questions")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["total_questions"], 19)
+
+    def test_get_slow_queries(self):
+        self.app.config["ADMIN_TOKEN"] = "secret"
+        admin = {"Authorization": "Bearer secret"}
+        slow_query_log = self.app.extensions["slow_query_log"]
+        slow_query_log.threshold_ms = 0
+        slow_query_log.explain_rate = 1.0
+        slow_query_log.redact_parameters = False
+        self.client.get("/categories/3/questions")
+        slow_query_log.threshold_ms = 60000
+        res = self.client.get("/admin/slow-queries", headers=admin)
+        data = json.loads(res.data)
+        queries = [
+            query for query in data["queries"]
+            if "questions.category =" in query["sql"]
+        ]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["threshold_ms"], 60000)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(queries[0]["endpoint"], "get_questions_by_category")
+        self.assertEqual(queries[0]["parameters"], {"category_id": 3})
+        self.assertIn("Plan", queries[0]["plan"][0])
+        res = self.client.get("/admin/slow-queries?limit=1", headers=admin)
+        self.assertEqual(len(json.loads(res.data)["queries"]), 1)
+
+    def test_slow_queries_redact_parameters_by_default(self):
+        self.app.config["ADMIN_TOKEN"] = "secret"
+        self.app.extensions["slow_query_log"].threshold_ms = 0
+        self.client.post("/questions/search", json={"search_term": "title"})
+        res = self.client.get("/admin/slow-queries", headers={"Authorization": "Bearer secret"})
+        queries = json.loads(res.data)["queries"]
+
+        self.assertTrue(queries)
+        self.assertTrue(all(query["parameters"] is None for query in queries))
+
+    def test_admin_settings_from_environment(self):
+        log_path = os.path.join(tempfile.mkdtemp(), "slow.jsonl")
+        environment = {
+            "FLASK_DB_CREATE_ALL": "false",
+            "FLASK_ADMIN_TOKEN": "12345",
+            "FLASK_SLOW_QUERY_MS": "50",
+            "FLASK_SLOW_QUERY_LOG_FILE": log_path,
+        }
+        with mock.patch.dict(os.environ, environment):
+            app = create_app()
+        app.extensions["job_runner"].shutdown()
+        slow_query_log = app.extensions["slow_query_log"]
+
+        self.assertEqual(slow_query_log.threshold_ms, 50)
+        self.assertEqual(slow_query_log.log_path, log_path)
+        res = app.test_client().get(
+            "/admin/slow-queries", headers={"Authorization": "Bearer 12345"}
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data)["threshold_ms"], 50)
+
+    def test_get_slow_queries_needs_admin_token(self):
+        res = self.client.get("/admin/slow-queries")
+        self.assertEqual(res.status_code, 404)
+
+        self.app.config["ADMIN_TOKEN"] = "secret"
+        for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": "secret"}):
+            res = self.client.get("/admin/slow-queries", headers=headers)
+            self.assertEqual(res.status_code, 401)
+            self.assertEqual(json.loads(res.data), {"success": False, "error": "Unauthorized"})
+
+    def test_create_duplicate_question_409(self):
+        new_question = {
+            "answer": "Maya Angelou",
+            "category": 4,
+            "difficulty": 2,
+            "question": "whose autobiography is entitled: I know why the caged bird sings",
+        }
+        res = self.client.post("/questions", json=new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(data["error"], "Conflict")
+        self.assertEqual(data["duplicates"], [{"id": 5, "similarity": 1.0}])
+        res = self.client.get("/questions")
+        self.assertEqual(json.loads(res.data)["total_questions"], 19)
+
+    def test_bulk_update_duplicate_question(self):
+        payload = {
+            "questions": [
+                {"id": 6, "question": "What boxer's original name is Cassius Clay??"},
+                {"id": 10, "difficulty": 2},
+            ]
+        }
+        res = self.client.patch("/questions", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data["results"],
+            [
+                {
+                    "id": 6,
+                    "status": "duplicate",
+                    "version": None,
+                    "duplicates": [{"id": 9, "similarity": 1.0}],
+                },
+                {"id": 10, "status": "updated", "version": 2},
+            ],
+        )
+
+    def test_bulk_update_duplicates_within_batch(self):
+        payload = {
+            "questions": [
+                {"id": 6, "question": "Which river flows through Budapest?"},
+                {"id": 10, "question": "Which river flows through Budapest"},
+            ]
+        }
+        res = self.client.patch("/questions", json=payload)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data["results"],
+            [
+                {"id": 6, "status": "updated", "version": 2},
+                {
+                    "id": 10,
+                    "status": "duplicate",
+                    "version": None,
+                    "duplicates": [{"id": 6, "similarity": 1.0}],
+                },
+            ],
+        )
+
+    def test_get_duplicate_questions(self):
+        res = self.client.get("/questions/duplicates")
+        self.assertEqual(json.loads(res.data)["total_clusters"], 0)
+
+        with self.app.app_context():
+            Question(
+                question="What boxer's original name is 'Cassius Clay'?",
+                answer="Muhammad Ali",
+                category=4,
+                difficulty=1,
+            ).insert()
+        res = self.client.get("/questions/duplicates")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_clusters"], 1)
+        self.assertEqual(
+            [question["answer"] for question in data["clusters"][0]],
+            ["Muhammad Ali", "Muhammad Ali"],
+        )
+
+    def test_get_stats(self):
+        res = self.client.get("/stats?bucket=25")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 19)
+        self.assertEqual(data["bucket"], 25)
+        self.assertEqual(sum(row["count"] for row in data["counts"]), 19)
+        self.assertEqual(len(data["categories"]), 6)
+        self.assertEqual(sum(category["count"] for category in data["categories"]), 19)
+        self.assertEqual(sum(row["count"] for row in data["difficulties"]), 19)
+        self.assertEqual(sum(row["count"] for row in data["length_histogram"]), 19)
+        for row in data["length_histogram"]:
+            self.assertEqual(row["from"] % 25, 0)
+            self.assertEqual(row["to"], row["from"] + 24)
+
+    def test_get_stats_after_create_question(self):
+        self.client.get("/stats")
+        new_question = {
+            "answer": "Lake Superior",
+            "category": 3,
+            "difficulty": 5,
+            "question": "What is the largest freshwater lake in the world by surface area?",
+        }
+        self.client.post("/questions", json=new_question)
+        res = self.client.get("/stats")
+        data = json.loads(res.data)
+
+        self.assertEqual(data["total_questions"], 20)
+        self.assertIn({"category": 3, "difficulty": 5, "count": 1}, data["counts"])
+
+    def test_get_stats_400(self):
+        res = self.client.get("/stats?bucket=0")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data, {"success": False, "error": "Bad Request"})
+
+    def test_question_changes_wait_for_change_feed_lock(self):
+        new_question = {
+            "answer": "Lake Superior",
+            "category": 3,
+            "difficulty": 3,
+            "question": "What is the largest freshwater lake in the world by surface area?",
+        }
+        responses = []
+        with self.engine.connect() as connection:
+            transaction = connection.begin()
+            connection.execute(text(f"SELECT pg_advisory_xact_lock({CHANGE_FEED_LOCK})"))
+            writer = threading.Thread(
+                target=lambda: responses.append(
+                    self.client.post("/questions", json=new_question)
+                )
+            )
+            writer.start()
+            writer.join(0.5)
+            self.assertTrue(writer.is_alive())
+            transaction.commit()
+        writer.join()
+
+        self.assertEqual(responses[0].status_code, 201)
+        res = self.client.get("/questions/changes")
+        self.assertEqual(len(json.loads(res.data)["changes"]), 1)
+
+    def test_index_notices_replaced_category(self):
+        self.app.extensions["question_index"].refresh_interval = 0
+        self.client.post("/quizzes", json={"previous_questions": [], "quiz_category": 6})
+        with self.engine.begin() as connection:
+            connection.execute(text("DELETE FROM questions WHERE category = 6"))
+            connection.execute(text("DELETE FROM categories WHERE id = 6"))
+            category_id = connection.execute(
+                text("INSERT INTO categories (type) VALUES ('Cooking') RETURNING id")
+            ).scalar()
+
+        payload = {"question": "Q", "answer": "A", "category": category_id, "difficulty": 1}
+        res = self.client.post("/questions", json=payload)
+        self.assertEqual(res.status_code, 201)
+        res = self.client.post("/quizzes", json={"previous_questions": [], "quiz_category": 6})
+        self.assertEqual(res.status_code, 400)
+
+
+class QuestionPoolsTestCase(unittest.TestCase):
+    """This class represents the shared question pool test case"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.publisher = QuestionPools(directory=self.directory)
+        self.reader = QuestionPools(directory=self.directory)
+
+    def tearDown(self):
+        self.reader.close()
+        self.publisher.close(unlink=True)
+        os.rmdir(self.directory)
+
+    def test_nothing_published(self):
+        self.assertIsNone(self.reader.current())
+
+    def test_publish_and_read(self):
+        self.publisher.publish((23, 4, 3), {1: [(20, 4), (22, 4)], 2: [(16, 1)], 3: []})
+        snapshot = self.reader.current()
+
+        self.assertEqual(snapshot.watermark, (23, 4, 3))
+        self.assertEqual(list(snapshot.ids(1)), [20, 22])
+        self.assertEqual(list(snapshot.rows(2)), [(16, 1)])
+        self.assertEqual(snapshot.counts(), {1: 2, 2: 1, 3: 0})
+        self.assertTrue(snapshot.has_category(3))
+        self.assertFalse(snapshot.has_category(4))
+        self.assertEqual(snapshot.count(), 3)
+
+    def test_publish_swaps_version(self):
+        first = self.publisher.publish((20, 1, 1), {1: [(20, 4)]})
+        self.assertEqual(self.reader.current().version, first)
+        second = self.publisher.publish((22, 2, 1), {1: [(20, 4), (22, 4)]})
+        snapshot = self.reader.current()
+
+        self.assertEqual(snapshot.version, second)
+        self.assertEqual(list(snapshot.ids(1)), [20, 22])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, f"pools.{first}")))
+
+    def test_publish_keeps_newer_snapshot(self):
+        newer = self.publisher.publish((22, 2, 1), {1: [(20, 4), (22, 4)]})
+        version = self.publisher.publish((20, 1, 1), {1: [(20, 4)]})
+        snapshot = self.reader.current()
+
+        self.assertEqual(version, newer)
+        self.assertEqual(snapshot.version, newer)
+        self.assertEqual(snapshot.watermark, (22, 2, 1))
+
+    def test_concurrent_publishes_leave_one_segment(self):
+        children = []
+        for worker in range(4):
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    pools = QuestionPools(directory=self.directory)
+                    for attempt in range(25):
+                        pools.publish((attempt, 1, 1), {1: [(worker, 1)]})
+                finally:
+                    os._exit(0)
+            children.append(pid)
+        for pid in children:
+            os.waitpid(pid, 0)
+        segments = [entry for entry in os.listdir(self.directory) if entry.startswith("pools.")]
+
+        self.assertEqual(segments, [f"pools.{self.reader.current().version}"])
+        self.assertEqual(self.reader.current().watermark, (24, 1, 1))
+
+    def test_current_retries_when_segment_replaced(self):
+        self.publisher.publish((20, 1, 1), {1: [(20, 4)]})
+        attach = self.reader._store.attach
+
+        def attach_after_replace(version):
+            self.reader._store.attach = attach
+            self.publisher.publish((22, 2, 1), {1: [(20, 4), (22, 4)]})
+            return attach(version)
+
+        self.reader._store.attach = attach_after_replace
+        snapshot = self.reader.current()
+
+        self.assertEqual(snapshot.watermark, (22, 2, 1))
+
+    def test_current_keeps_snapshot_a_reader_holds(self):
+        self.publisher.publish((20, 1, 1), {1: [(20, 4)]})
+        rows = self.reader.current().rows()
+        self.publisher.publish((21, 1, 1), {1: [(21, 4)]})
+        self.reader.current()
+        self.publisher.publish((22, 1, 1), {1: [(22, 4)]})
+
+        self.assertEqual(list(self.reader.current().ids(1)), [22])
+        self.assertEqual(list(rows), [(20, 4)])
+        del rows
+        self.publisher.publish((23, 1, 1), {1: [(23, 4)]})
+        self.assertEqual(list(self.reader.current().ids(1)), [23])
+        self.assertEqual(len(self.reader._retired), 1)
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
@@ -0,0 +1,22 @@
+"""
+WSGI entry point for preloaded deployments:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built and its caches warmed once in the gunicorn master; the
+remaining objects are then moved out of the garbage collector's reach with
+gc.freeze() so that collections in the workers do not write to (and so
+copy) the pages they share with the master. gunicorn.conf.py calls
+post_fork() in every worker to replace the inherited connection pool.
+
+Settings come from FLASK_-prefixed environment variables, e.g.
+FLASK_DB_CREATE_ALL=false or FLASK_QUESTION_POOLS_MODE=shm.
+"""
+import gc
+
+from flaskr import create_app, warm_app
+
+app = create_app()
+warm_app(app)
+gc.collect()
+gc.freeze()
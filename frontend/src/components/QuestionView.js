@@ -12,6 +12,7 @@ class QuestionView extends Component {
       page: 1,
       totalQuestions: 0,
       categories: [],
+      categoriesVersion: null,
       currentCategory: null,
     };
   }
@@ -21,14 +22,24 @@ class QuestionView extends Component {
   }
 
   getQuestions = () => {
+    // categories are only fetched again when the server reports a new version
+    const include = this.state.categories.length
+      ? 'total_questions,current_category'
+      : 'categories,total_questions,current_category';
     $.ajax({
-      url: `/questions?page=${this.state.page}`, //TODO: update request URL
+      url: `/questions?page=${this.state.page}&include=${include}`, //TODO: update request URL
       type: 'GET',
-      success: (result) => {
+      success: (result, status, xhr) => {
+        const categoriesVersion = xhr.getResponseHeader('X-Categories-Version');
+        if (!result.categories && categoriesVersion !== this.state.categoriesVersion) {
+          this.setState({ categories: [] }, () => this.getQuestions());
+          return;
+        }
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          categories: result.categories,
+          categories: result.categories || this.state.categories,
+          categoriesVersion: categoriesVersion,
           currentCategory: result.current_category,
         });
         return;